@@ -0,0 +1,107 @@
+// Copyright (c) 2021 Juan Miguel Jimeno
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//     http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+
+#include <algorithm>
+#include <functional>
+#include <memory>
+
+#include "geometry_msgs/msg/twist.hpp"
+#include "rclcpp/rclcpp.hpp"
+#include "rclcpp_components/register_node_macro.hpp"
+#include "std_msgs/msg/float64.hpp"
+
+namespace linorobot2_components
+{
+
+// Same behavior as linorobot2_gazebo/command_timeout.py, as a component that can share a
+// container (and intra-process messages) with the nodes it talks to
+class CommandTimeout : public rclcpp::Node
+{
+public:
+  explicit CommandTimeout(const rclcpp::NodeOptions & options)
+  : Node("command_timeout", options)
+  {
+    timeout_ = declare_parameter("timeout", 0.2);
+    prev_cmd_time_ = now();
+
+    twist_publisher_ = create_publisher<geometry_msgs::msg::Twist>("cmd_vel", 10);
+    latency_publisher_ = create_publisher<std_msgs::msg::Float64>("~/stop_latency", 10);
+
+    // One-shot deadline, armed by each non-zero command instead of polling
+    brake_timer_ = rclcpp::create_timer(
+      this, get_clock(), rclcpp::Duration::from_seconds(timeout_),
+      std::bind(&CommandTimeout::brake_timer_callback, this));
+    brake_timer_->cancel();
+
+    twist_subscription_ = create_subscription<geometry_msgs::msg::Twist>(
+      "cmd_vel", 10, std::bind(&CommandTimeout::twist_callback, this, std::placeholders::_1));
+  }
+
+private:
+  void brake_timer_callback()
+  {
+    brake_timer_->cancel();
+    if (zero_cmd_sent_) {
+      return;
+    }
+
+    // Unique pointers are handed to intra-process subscribers without a copy
+    zero_cmd_sent_ = true;
+    twist_publisher_->publish(std::make_unique<geometry_msgs::msg::Twist>());
+
+    double stop_latency = (now() - prev_cmd_time_).seconds();
+    stop_count_++;
+    max_stop_latency_ = std::max(max_stop_latency_, stop_latency);
+    total_stop_latency_ += stop_latency;
+
+    auto latency_msg = std::make_unique<std_msgs::msg::Float64>();
+    latency_msg->data = stop_latency;
+    latency_publisher_->publish(std::move(latency_msg));
+    RCLCPP_DEBUG(
+      get_logger(),
+      "Braked %.1f ms after the last command (timeout %.0f ms, max %.1f ms, mean %.1f ms over %zu stops)",
+      stop_latency * 1e3, timeout_ * 1e3, max_stop_latency_ * 1e3,
+      total_stop_latency_ / stop_count_ * 1e3, stop_count_);
+  }
+
+  void twist_callback(geometry_msgs::msg::Twist::ConstSharedPtr msg)
+  {
+    if (msg->linear.x == 0.0 && msg->linear.y == 0.0 && msg->angular.z == 0.0) {
+      return;
+    }
+
+    zero_cmd_sent_ = false;
+    prev_cmd_time_ = now();
+    // Restarts the full timeout from this command
+    brake_timer_->reset();
+  }
+
+  double timeout_;
+  rclcpp::Time prev_cmd_time_;
+  bool zero_cmd_sent_ = true;
+
+  // Stop latency statistics: time from the last command to the brake command
+  size_t stop_count_ = 0;
+  double max_stop_latency_ = 0.0;
+  double total_stop_latency_ = 0.0;
+
+  rclcpp::Publisher<geometry_msgs::msg::Twist>::SharedPtr twist_publisher_;
+  rclcpp::Publisher<std_msgs::msg::Float64>::SharedPtr latency_publisher_;
+  rclcpp::Subscription<geometry_msgs::msg::Twist>::SharedPtr twist_subscription_;
+  rclcpp::TimerBase::SharedPtr brake_timer_;
+};
+
+}  // namespace linorobot2_components
+
+RCLCPP_COMPONENTS_REGISTER_NODE(linorobot2_components::CommandTimeout)
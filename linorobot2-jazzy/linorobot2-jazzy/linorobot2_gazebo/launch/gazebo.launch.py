@@ -21,7 +21,7 @@ from launch_ros.actions import Node
 from launch_ros.substitutions import FindPackageShare
 from launch_ros.actions import ComposableNodeContainer
 from launch_ros.descriptions import ComposableNode
-from launch.conditions import IfCondition
+from launch.conditions import IfCondition, UnlessCondition
 
 
 def generate_launch_description():
@@ -48,6 +48,29 @@ def generate_launch_description():
         [FindPackageShare('linorobot2_description'), 'launch', 'description.launch.py']
     )
 
+    cmd_vel_bridge_config_path = PathJoinSubstitution(
+        [FindPackageShare("linorobot2_gazebo"), "config", "cmd_vel_bridge.yaml"]
+    )
+
+    bridge_arguments = [
+        "/clock@rosgraph_msgs/msg/Clock[gz.msgs.Clock",
+        "/odom/unfiltered@nav_msgs/msg/Odometry[gz.msgs.Odometry",
+        "/imu/data@sensor_msgs/msg/Imu[gz.msgs.IMU",
+        "/joint_states@sensor_msgs/msg/JointState[gz.msgs.Model",
+        "/scan@sensor_msgs/msg/LaserScan[gz.msgs.LaserScan",
+        "/camera/camera_info@sensor_msgs/msg/CameraInfo[gz.msgs.CameraInfo",
+        "/camera/image@sensor_msgs/msg/Image[gz.msgs.Image",
+        "/camera/depth_image@sensor_msgs/msg/Image[gz.msgs.Image",
+        "/camera/points@sensor_msgs/msg/PointCloud2[gz.msgs.PointCloudPacked",
+    ]
+
+    bridge_remappings = [
+        ('/camera/camera_info', '/camera/color/camera_info'),
+        ('/camera/image', '/camera/color/image_raw'),
+        ('/camera/depth_image', '/camera/depth/image_rect_raw'),
+        ('/camera/points', '/camera/depth/color/points'),
+    ]
+
     return LaunchDescription([
         DeclareLaunchArgument(
             name='gui', 
@@ -96,6 +119,12 @@ def generate_launch_description():
             default_value='0.0',
             description='Robot spawn heading'
         ),
+
+        DeclareLaunchArgument(
+            name='use_composition', 
+            default_value='false',
+            description='Run command_timeout and the cmd_vel bridge as components in one intra-process container'
+        ),
         
         IncludeLaunchDescription(
             PythonLaunchDescriptionSource(gazebo_launch_path),
@@ -129,30 +158,48 @@ def generate_launch_description():
         Node(
             package="ros_gz_bridge",
             executable="parameter_bridge",
-            arguments=[
-                "/clock@rosgraph_msgs/msg/Clock[gz.msgs.Clock",
-                "/cmd_vel@geometry_msgs/msg/Twist@gz.msgs.Twist",
-                "/odom/unfiltered@nav_msgs/msg/Odometry[gz.msgs.Odometry",
-                "/imu/data@sensor_msgs/msg/Imu[gz.msgs.IMU",
-                "/joint_states@sensor_msgs/msg/JointState[gz.msgs.Model",
-                "/scan@sensor_msgs/msg/LaserScan[gz.msgs.LaserScan",
-                "/camera/camera_info@sensor_msgs/msg/CameraInfo[gz.msgs.CameraInfo",
-                "/camera/image@sensor_msgs/msg/Image[gz.msgs.Image",
-                "/camera/depth_image@sensor_msgs/msg/Image[gz.msgs.Image",
-                "/camera/points@sensor_msgs/msg/PointCloud2[gz.msgs.PointCloudPacked",
-            ],
-            remappings=[
-                ('/camera/camera_info', '/camera/color/camera_info'),
-                ('/camera/image', '/camera/color/image_raw'),
-                ('/camera/depth_image', '/camera/depth/image_rect_raw'),
-                ('/camera/points', '/camera/depth/color/points'),
-            ]
+            condition=UnlessCondition(LaunchConfiguration('use_composition')),
+            arguments=bridge_arguments + ["/cmd_vel@geometry_msgs/msg/Twist@gz.msgs.Twist"],
+            remappings=bridge_remappings
         ),
 
         Node(
             package='linorobot2_gazebo',
             executable='command_timeout',
-            name='command_timeout'
+            name='command_timeout',
+            condition=UnlessCondition(LaunchConfiguration('use_composition'))
+        ),
+
+        # The cmd_vel bridge moves into the container so brake commands reach it without serialization
+        Node(
+            package="ros_gz_bridge",
+            executable="parameter_bridge",
+            condition=IfCondition(LaunchConfiguration('use_composition')),
+            arguments=bridge_arguments,
+            remappings=bridge_remappings
+        ),
+
+        ComposableNodeContainer(
+            name='command_timeout_container',
+            namespace='',
+            package='rclcpp_components',
+            executable='component_container',
+            condition=IfCondition(LaunchConfiguration('use_composition')),
+            composable_node_descriptions=[
+                ComposableNode(
+                    package='linorobot2_components',
+                    plugin='linorobot2_components::CommandTimeout',
+                    name='command_timeout',
+                    extra_arguments=[{'use_intra_process_comms': True}]
+                ),
+                ComposableNode(
+                    package='ros_gz_bridge',
+                    plugin='ros_gz_bridge::RosGzBridge',
+                    name='cmd_vel_bridge',
+                    parameters=[{'config_file': cmd_vel_bridge_config_path}],
+                    extra_arguments=[{'use_intra_process_comms': True}]
+                ),
+            ]
         ),
 
         Node(
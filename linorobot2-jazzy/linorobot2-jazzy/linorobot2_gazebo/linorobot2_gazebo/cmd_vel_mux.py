@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2021 Juan Miguel Jimeno
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http:#www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from functools import partial
+
+import rclpy
+from rclpy.node import Node
+from std_msgs.msg import Float64
+from geometry_msgs.msg import Twist
+
+class MuxInput:
+    def __init__(self, name, topic, priority, timeout, lockout, brake_on_timeout):
+        self.name = name
+        self.topic = topic
+        self.priority = priority
+        self.timeout_ns = int(timeout * 1e9)
+        self.lockout_ns = int(lockout * 1e9)
+        self.brake_on_timeout = brake_on_timeout
+        self.twist = Twist()
+        self.last_time = None
+        self.active_since = None
+
+    def active(self, now):
+        # Commands newer than the timeout are forwarded
+        return self.last_time is not None and now < self.last_time + self.timeout_ns
+
+    def locked(self, now):
+        # After the timeout the input keeps lower priorities out for its lock-out window
+        return self.last_time is not None and now < self.expiry()
+
+    def expiry(self):
+        return self.last_time + self.timeout_ns + self.lockout_ns
+
+class CmdVelMux(Node):
+    def __init__(self):
+        super().__init__('cmd_vel_mux')
+        rate = self.declare_parameter('rate', 20.0).value
+        output_topic = self.declare_parameter('output_topic', 'cmd_vel').value
+        input_names = self.declare_parameter('inputs', ['joy', 'navigation']).value
+        self.period_ns_ = int(1e9 / rate)
+
+        self.inputs_ = []
+        for name in input_names:
+            mux_input = MuxInput(
+                name,
+                self.declare_parameter(f'{name}.topic', f'cmd_vel/{name}').value,
+                self.declare_parameter(f'{name}.priority', 0).value,
+                self.declare_parameter(f'{name}.timeout', 0.5).value,
+                self.declare_parameter(f'{name}.lockout', 0.0).value,
+                self.declare_parameter(f'{name}.brake_on_timeout', True).value,
+            )
+            self.create_subscription(Twist, mux_input.topic, partial(self.twist_callback, mux_input), 10)
+            self.inputs_.append(mux_input)
+
+        # Highest priority first, the order of the inputs parameter breaks ties
+        self.inputs_.sort(key=lambda mux_input: -mux_input.priority)
+        self.selected_ = None
+        self.max_handover_latency_ = 0.0
+
+        self.twist_publisher_ = self.create_publisher(Twist, output_topic, 10)
+        self.latency_publisher_ = self.create_publisher(Float64, '~/handover_latency', 10)
+        self.mux_timer_ = self.create_timer(1.0 / rate, self.mux_timer_callback)
+
+    def twist_callback(self, mux_input, msg):
+        now = self.get_clock().now().nanoseconds
+        if not mux_input.active(now):
+            mux_input.active_since = now
+
+        mux_input.twist = msg
+        mux_input.last_time = now
+
+    def mux_timer_callback(self):
+        now = self.get_clock().now().nanoseconds
+        selected = None
+        for mux_input in self.inputs_:
+            if mux_input.locked(now):
+                selected = mux_input
+                break
+
+        previous = self.selected_
+        if selected is not previous:
+            self.selected_ = selected
+            if selected is not None:
+                self.report_handover(previous, selected, now)
+            elif previous.brake_on_timeout:
+                self.twist_publisher_.publish(Twist())
+                self.get_logger().info(f'{previous.name} timed out, braking')
+
+        if selected is None:
+            return
+
+        if selected.active(now):
+            self.twist_publisher_.publish(selected.twist)
+        elif selected.brake_on_timeout:
+            # A braking source holds the robot still through its lock-out window, others only keep lower
+            # priorities out
+            self.twist_publisher_.publish(Twist())
+
+    def report_handover(self, previous, selected, now):
+        # Due at the first command of the new source, or at the end of the window of the source it replaces
+        due = selected.active_since
+        if previous is not None and not previous.locked(now):
+            due = max(due, previous.expiry())
+
+        latency = (now - due) * 1e-9
+        self.max_handover_latency_ = max(self.max_handover_latency_, latency)
+        self.latency_publisher_.publish(Float64(data=latency))
+
+        previous_name = previous.name if previous is not None else 'idle'
+        message = (
+            f'{previous_name} -> {selected.name} in {latency * 1e3:.1f} ms '
+            f'(max {self.max_handover_latency_ * 1e3:.1f} ms)'
+        )
+        if latency * 1e9 > self.period_ns_:
+            self.get_logger().warn(f'{message}, longer than the {self.period_ns_ * 1e-6:.0f} ms control period')
+        else:
+            self.get_logger().info(message)
+
+def main(args=None):
+    rclpy.init(args=args)
+
+    cmd_vel_mux = CmdVelMux()
+    rclpy.spin(cmd_vel_mux)
+    cmd_vel_mux.destroy_node()
+    rclpy.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -15,17 +15,26 @@
 
 import rclpy
 from rclpy.node import Node
-from std_msgs.msg import String
+from std_msgs.msg import Float64, String
 from geometry_msgs.msg import Twist
 
 class CommandTimeout(Node):
     def __init__(self):
         super().__init__('command_timeout')
+        self.timeout_ = self.declare_parameter('timeout', 0.2).value
         self.prev_cmd_time_ = self.get_clock().now()
         self.zero_cmd_sent_ = True
         self.twist_publisher_ = self.create_publisher(Twist, 'cmd_vel', 10)
+        self.latency_publisher_ = self.create_publisher(Float64, '~/stop_latency', 10)
+
+        # Stop latency statistics: time from the last command to the brake command
+        self.stop_count_ = 0
+        self.max_stop_latency_ = 0.0
+        self.total_stop_latency_ = 0.0
         
-        brake_timer = self.create_timer(0.2, self.brake_timer_callback)
+        # One-shot deadline, armed by each non-zero command instead of polling
+        self.brake_timer_ = self.create_timer(self.timeout_, self.brake_timer_callback)
+        self.brake_timer_.cancel()
 
         twist_subscription = self.create_subscription(
             Twist,
@@ -35,17 +44,27 @@ class CommandTimeout(Node):
         twist_subscription
 
     def brake_timer_callback(self):
-        now = self.get_clock().now()
-        dt = (now - self.prev_cmd_time_).nanoseconds
+        self.brake_timer_.cancel()
+        if self.zero_cmd_sent_:
+            return
+
+        self.zero_cmd_sent_ = True
+        twist_msg = Twist()
+        twist_msg.linear.x = 0.0
+        twist_msg.linear.y = 0.0
+        twist_msg.angular.z = 0.0
+        self.twist_publisher_.publish(twist_msg)
 
-        #5Hz
-        if dt >= 2e+8 and not self.zero_cmd_sent_:
-            self.zero_cmd_sent_ = True
-            twist_msg = Twist()
-            twist_msg.linear.x = 0.0
-            twist_msg.linear.y = 0.0
-            twist_msg.angular.z = 0.0
-            self.twist_publisher_.publish(twist_msg)
+        stop_latency = (self.get_clock().now() - self.prev_cmd_time_).nanoseconds * 1e-9
+        self.stop_count_ += 1
+        self.max_stop_latency_ = max(self.max_stop_latency_, stop_latency)
+        self.total_stop_latency_ += stop_latency
+        self.latency_publisher_.publish(Float64(data=stop_latency))
+        self.get_logger().debug(
+            f'Braked {stop_latency * 1e3:.1f} ms after the last command '
+            f'(timeout {self.timeout_ * 1e3:.0f} ms, max {self.max_stop_latency_ * 1e3:.1f} ms, '
+            f'mean {self.total_stop_latency_ / self.stop_count_ * 1e3:.1f} ms over {self.stop_count_} stops)'
+        )
 
     def twist_callback(self, msg):
         if msg.linear.x == 0 and msg.linear.y == 0 and msg.angular.z == 0:
@@ -53,6 +72,8 @@ class CommandTimeout(Node):
 
         self.zero_cmd_sent_ = False
         self.prev_cmd_time_ = self.get_clock().now()
+        # Restarts the full timeout from this command
+        self.brake_timer_.reset()
 
 def main(args=None):
     rclpy.init(args=args)
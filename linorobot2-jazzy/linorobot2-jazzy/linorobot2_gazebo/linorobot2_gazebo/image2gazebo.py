@@ -3,8 +3,40 @@ from tkinter import ttk, filedialog, simpledialog
 from PIL import Image, ImageTk
 import os
 import math
+import queue
+import threading
+from collections import OrderedDict
 import numpy as np
-from map2gazebo import process_maps
+from map2gazebo import (
+    BOX_FACES, PROGRESS_DONE, STL_HEADER_BYTES, STL_TRIANGLE, ConversionCancelled, load_map_image, occupied_cells,
+    process_maps, wall_map
+)
+from map_calibration import build_map_info, meters_per_pixel, origin_from_pixel
+
+
+# How often the Tk thread checks on a running world generation
+GENERATION_POLL_MS = 100
+
+# Quiet time after the last resize event before the image is redrawn
+RESIZE_DEBOUNCE_MS = 50
+
+# Pyramid levels are halved until their shorter side would drop below this
+PYRAMID_MIN_SIZE = 256
+
+# Edge length in canvas pixels of the rendered tiles, and how many of them are kept
+TILE_SIZE = 256
+TILE_CACHE_SIZE = 256
+
+# Zoom step per mouse wheel notch and the closest zoom in canvas pixels per image pixel
+ZOOM_STEP = 1.25
+MAX_ZOOM = 16.0
+
+# Color and opacity (0-255) of the occupancy overlay
+OVERLAY_COLOR = (255, 0, 0)
+OVERLAY_ALPHA = 128
+
+# Triangles of the box the default mesher builds for each occupied cell
+CELL_TRIANGLES = len(BOX_FACES)
 
 
 class MapImageProcessor(tk.Tk):
@@ -14,26 +46,43 @@ class MapImageProcessor(tk.Tk):
         self.geometry("1000x700")
         
         # Private map_info variable with default values
-        self.__map_info = {
-            "map_name": None,
-            "image": None,
-            "resolution": None,
-            "origin": [0.0, 0.0, 0.0],
-            "negate": 0,
-            "occupied_thresh": 0.65,
-            "free_thresh": 0.196,
-            "origin_pixel": None  # Store pixel coordinates for redrawing
-        }
+        self.__map_info = dict(
+            build_map_info(""),
+            map_name=None,
+            image=None,
+            origin_pixel=None  # Store pixel coordinates for redrawing
+        )
         
         # State variables
         self.current_image = None
+        self.image_pyramid = {}
+        self.resize_job = None
         self.image_path = None
-        self.tk_image = None
         self.canvas_image = None
+        
+        # Viewport: canvas position of the image's top-left corner and canvas pixels per image pixel
+        self.image_offset = (0.0, 0.0)
+        self.image_scale = 1.0
+        self.fit_scale = 1.0
+        self.view_fitted = True
+        self.pan_start = None
+        self.tile_cache = OrderedDict()
+        
+        # Occupancy overlay levels matching the image pyramid, thresholded once per image
+        self.occupancy_pyramid = {}
         self.click_points = []
         self.click_count = 0
         self.click_mode = None
         
+        # Thresholding for the overlay runs on a worker thread too, results are matched to the image by path
+        self.occupancy_thread = None
+        self.occupancy_queue = queue.Queue()
+        
+        # World generation runs on a worker thread that reports through the queue
+        self.generation_thread = None
+        self.generation_queue = queue.Queue()
+        self.cancel_event = threading.Event()
+        
         self.create_widgets()
         
     def create_widgets(self):
@@ -53,6 +102,15 @@ class MapImageProcessor(tk.Tk):
         self.canvas = tk.Canvas(self.image_frame, bg="white")
         self.canvas.pack(fill=tk.BOTH, expand=True)
         self.canvas.bind("<Button-1>", self.on_canvas_click)
+        self.canvas.bind("<Configure>", self.on_resize)
+        
+        # Mouse wheel zooms around the cursor, middle or right drag pans
+        self.canvas.bind("<MouseWheel>", self.on_zoom)
+        self.canvas.bind("<Button-4>", self.on_zoom)
+        self.canvas.bind("<Button-5>", self.on_zoom)
+        for button in (2, 3):
+            self.canvas.bind(f"<ButtonPress-{button}>", self.on_pan_start)
+            self.canvas.bind(f"<B{button}-Motion>", self.on_pan)
         
         # Status bar at the bottom of the canvas
         self.status_bar = ttk.Label(self.image_frame, text="No image loaded", anchor=tk.W)
@@ -63,6 +121,10 @@ class MapImageProcessor(tk.Tk):
         load_button = ttk.Button(sidebar_frame, text="Load Image", command=self.load_image)
         load_button.pack(fill=tk.X, padx=10, pady=5)
         
+        # Fit to Window button, undoes zoom and pan
+        fit_button = ttk.Button(sidebar_frame, text="Fit to Window", command=self.display_image)
+        fit_button.pack(fill=tk.X, padx=10, pady=5)
+        
         ttk.Separator(sidebar_frame).pack(fill=tk.X, padx=10, pady=5)
 
         # Set Meters Per Pixel button
@@ -85,10 +147,22 @@ class MapImageProcessor(tk.Tk):
         
         ttk.Separator(sidebar_frame).pack(fill=tk.X, padx=10, pady=5)
         
+        # Occupancy overlay toggle, shows what map2gazebo will turn into walls
+        self.show_occupancy_var = tk.BooleanVar(value=False)
+        occupancy_check = ttk.Checkbutton(sidebar_frame, text="Show Occupancy", variable=self.show_occupancy_var,
+                                          command=self.toggle_occupancy)
+        occupancy_check.pack(fill=tk.X, padx=10, pady=5)
+        
+        ttk.Separator(sidebar_frame).pack(fill=tk.X, padx=10, pady=5)
+        
         # Generate World button
         self.generate_button = ttk.Button(sidebar_frame, text="Generate World", command=self.generate_world)
         self.generate_button.pack(fill=tk.X, padx=10, pady=5)
         
+        # Cancel button, only enabled while a world is being generated
+        self.cancel_button = ttk.Button(sidebar_frame, text="Cancel", command=self.cancel_generation, state=tk.DISABLED)
+        self.cancel_button.pack(fill=tk.X, padx=10, pady=5)
+        
         # Info display
         info_frame = ttk.LabelFrame(sidebar_frame, text="Map Info")
         info_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -101,6 +175,10 @@ class MapImageProcessor(tk.Tk):
         origin_label = ttk.Label(info_frame, textvariable=self.origin_var)
         origin_label.pack(anchor=tk.W, padx=5, pady=2)
         
+        self.estimate_var = tk.StringVar(value="Mesh estimate: show occupancy")
+        estimate_label = ttk.Label(info_frame, textvariable=self.estimate_var, justify=tk.LEFT)
+        estimate_label.pack(anchor=tk.W, padx=5, pady=2)
+        
     def load_image(self):
         """Load an image file and display it on the canvas"""
         file_types = [
@@ -111,21 +189,8 @@ class MapImageProcessor(tk.Tk):
         
         if file_path:
             try:
-                # Reset map_info when loading a new image
-                self.__map_info = {
-                    "map_name": None,
-                    "image": file_path,
-                    "resolution": None,
-                    "origin": [0.0, 0.0, 0.0],
-                    "negate": 0,
-                    "occupied_thresh": 0.65,
-                    "free_thresh": 0.196,
-                    "origin_pixel": None
-                }
-                
-                # Add map_name based on the YAML filename
-                map_name = os.path.splitext(os.path.basename(file_path))[0]
-                self.__map_info['map_name'] = map_name
+                # Reset map_info when loading a new image, named after the image file
+                self.__map_info = dict(build_map_info(file_path), origin_pixel=None)
 
                 # Update UI to reflect reset map_info
                 self.resolution_var.set(f"Resolution: Not set")
@@ -134,6 +199,11 @@ class MapImageProcessor(tk.Tk):
                 # Load and display the image
                 self.image_path = file_path
                 self.current_image = Image.open(file_path)
+                self.image_pyramid = {}
+                self.occupancy_pyramid = {}
+                self.tile_cache.clear()
+                self.show_occupancy_var.set(False)
+                self.estimate_var.set("Mesh estimate: show occupancy")
                 
                 # Clear any markers from previous image
                 self.canvas.delete("all")
@@ -146,17 +216,124 @@ class MapImageProcessor(tk.Tk):
             except Exception as e:
                 tk.messagebox.showerror("Error", f"Failed to load image: {str(e)}")
     
+    def pyramid_image(self, level):
+        """Image halved level times, decoded on first use and kept for later redraws"""
+        if level in self.image_pyramid:
+            return self.image_pyramid[level]
+        
+        if level == 0:
+            image = self.current_image
+        elif self.current_image.format == "JPEG" and level <= 3:
+            # JPEG decoders can scale by 1/2, 1/4 and 1/8 while decoding, the full image is never loaded
+            image = Image.open(self.image_path)
+            image.draft(image.mode, (math.ceil(image.width / 2 ** level), math.ceil(image.height / 2 ** level)))
+        else:
+            image = self.pyramid_image(level - 1).reduce(2)
+        
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        image.load()
+        
+        self.image_pyramid[level] = image
+        return image
+    
+    def compute_occupancy(self, image_path, map_info):
+        """Threshold the image the way map2gazebo does, runs on the worker thread"""
+        try:
+            # The pixel grid stands in for the world, so the crop offset comes back in pixels
+            metadata = dict(map_info, resolution=1.0, origin=[0.0, 0.0, 0.0])
+            map_array = load_map_image(image_path)
+            walls, cropped = wall_map(map_array, metadata)
+            occupied = occupied_cells(walls, cropped)
+            
+            # Back to the full image, top row first, as overlay opacity
+            x0, y0 = int(cropped["origin"][0]), int(cropped["origin"][1])
+            alpha = np.zeros(map_array.shape, dtype=np.uint8)
+            alpha[y0:y0 + occupied.shape[0], x0:x0 + occupied.shape[1]][occupied] = OVERLAY_ALPHA
+            overlay = Image.fromarray(np.ascontiguousarray(alpha[::-1]))
+        except Exception as e:
+            self.occupancy_queue.put((image_path, "error", str(e)))
+        else:
+            self.occupancy_queue.put((image_path, "done", (overlay, int(np.count_nonzero(occupied)))))
+    
+    def poll_occupancy(self):
+        """Apply the overlay and mesh estimate once the worker has thresholded the image"""
+        try:
+            image_path, kind, value = self.occupancy_queue.get_nowait()
+        except queue.Empty:
+            self.after(GENERATION_POLL_MS, self.poll_occupancy)
+            return
+        
+        self.occupancy_thread = None
+        if image_path != self.image_path:
+            # Another image was loaded meanwhile, threshold that one if the overlay is wanted
+            self.toggle_occupancy()
+            return
+        
+        if kind == "error":
+            self.show_occupancy_var.set(False)
+            self.status_bar.config(text="Thresholding failed")
+            tk.messagebox.showerror("Error", f"Failed to threshold image: {value}")
+            return
+        
+        overlay, cells = value
+        self.occupancy_pyramid = {0: overlay}
+        
+        # Every occupied cell is a box of 12 triangles with the default mesher
+        triangles = CELL_TRIANGLES * cells
+        stl_megabytes = (STL_HEADER_BYTES + STL_TRIANGLE.itemsize * triangles) / 1e6
+        self.estimate_var.set(f"Occupied cells: {cells}\nTriangles: {triangles}\nSTL size: {stl_megabytes:.1f} MB")
+        self.status_bar.config(text="Occupancy overlay ready")
+        self.render_view()
+    
+    def occupancy_image(self, level, size):
+        """Overlay opacity for a pyramid level, halved from the level above and cached"""
+        if level not in self.occupancy_pyramid:
+            # Halving averages the opacity, so thin walls stay visible at low zoom
+            self.occupancy_pyramid[level] = self.occupancy_image(level - 1, None).reduce(2)
+        
+        image = self.occupancy_pyramid[level]
+        if size is not None and image.size != size:
+            # JPEG draft decoding may round a level differently than halving does
+            image = image.resize(size, Image.BILINEAR)
+        return image
+    
+    def toggle_occupancy(self):
+        """Show or hide the occupancy overlay"""
+        if not self.current_image:
+            self.show_occupancy_var.set(False)
+            return
+        
+        if self.show_occupancy_var.get() and not self.occupancy_pyramid:
+            # Thresholding a large floor plan takes a while, the overlay appears once the worker is done
+            if self.occupancy_thread is None:
+                self.status_bar.config(text="Thresholding occupancy...")
+                self.occupancy_thread = threading.Thread(
+                    target=self.compute_occupancy, args=(self.image_path, dict(self.__map_info)), daemon=True
+                )
+                self.occupancy_thread.start()
+                self.after(GENERATION_POLL_MS, self.poll_occupancy)
+            return
+        
+        self.render_view()
+    
+    def pyramid_index(self, scale):
+        """Coarsest pyramid level that still has at least one pixel per canvas pixel"""
+        level = 0
+        width, height = self.current_image.size
+        while min(width, height) // 2 >= PYRAMID_MIN_SIZE and 1 / 2 ** (level + 1) >= scale:
+            width, height = math.ceil(width / 2), math.ceil(height / 2)
+            level += 1
+        return level
+    
     def display_image(self):
-        """Display the current image on the canvas"""
+        """Fit the current image to the canvas"""
+        self.resize_job = None
         if self.current_image:
-            # Clear existing canvas items
-            self.canvas.delete("all")
-            
             # Get canvas dimensions
             canvas_width = self.canvas.winfo_width()
             canvas_height = self.canvas.winfo_height()
             
-            # Resize image to fit canvas while maintaining aspect ratio
             img_width, img_height = self.current_image.size
             
             # If canvas size is too small, wait for it to be properly sized
@@ -164,45 +341,141 @@ class MapImageProcessor(tk.Tk):
                 self.after(100, self.display_image)
                 return
             
-            # Calculate scale factor
-            scale_w = canvas_width / img_width
-            scale_h = canvas_height / img_height
-            scale = min(scale_w, scale_h)
-            
-            # Calculate new dimensions
-            new_width = int(img_width * scale)
-            new_height = int(img_height * scale)
-            
-            # Resize the image
-            resized_img = self.current_image.resize((new_width, new_height), Image.LANCZOS)
-            self.tk_image = ImageTk.PhotoImage(resized_img)
+            # Calculate scale factor that fits the image while maintaining aspect ratio
+            scale = min(canvas_width / img_width, canvas_height / img_height)
             
-            # Calculate position to center the image
-            x_pos = (canvas_width - new_width) // 2
-            y_pos = (canvas_height - new_height) // 2
-            
-            # Display image on canvas
-            self.canvas_image = self.canvas.create_image(x_pos, y_pos, anchor=tk.NW, image=self.tk_image)
-            
-            # Store the scale factor for later use
+            # Center the image
+            self.fit_scale = scale
             self.image_scale = scale
-            self.image_offset = (x_pos, y_pos)
+            self.image_offset = ((canvas_width - img_width * scale) / 2, (canvas_height - img_height * scale) / 2)
+            self.view_fitted = True
             
-            # Redraw any markers
-            self.redraw_markers()
+            self.render_view()
+    
+    def render_tile(self, level, tile_x, tile_y, tile_pixels):
+        """Rendered tile of a pyramid level at the current zoom, from the LRU cache when possible"""
+        show_occupancy = self.show_occupancy_var.get() and bool(self.occupancy_pyramid)
+        key = (self.image_scale, level, tile_x, tile_y, show_occupancy)
+        if key in self.tile_cache:
+            self.tile_cache.move_to_end(key)
+            return self.tile_cache[key]
+        
+        image = self.pyramid_image(level)
+        factor = self.image_scale * self.current_image.width / image.width
+        box = (tile_x * tile_pixels, tile_y * tile_pixels,
+               min((tile_x + 1) * tile_pixels, image.width), min((tile_y + 1) * tile_pixels, image.height))
+        
+        # Tile edges are rounded from image coordinates, so neighbouring tiles meet without gaps
+        x0, y0 = round(box[0] * factor), round(box[1] * factor)
+        size = (max(1, round(box[2] * factor) - x0), max(1, round(box[3] * factor) - y0))
+        
+        # Zoomed in past one image pixel per canvas pixel, the pixels are shown as crisp squares
+        resample = Image.NEAREST if factor > 1 else Image.BILINEAR
+        tile_image = image.crop(box)
+        if show_occupancy:
+            # Walls are tinted at the level resolution, before the tile is scaled
+            tile_image = tile_image.convert("RGB")
+            opacity = self.occupancy_image(level, image.size).crop(box)
+            tile_image = Image.composite(Image.new("RGB", tile_image.size, OVERLAY_COLOR), tile_image, opacity)
+        tile = (x0, y0, ImageTk.PhotoImage(tile_image.resize(size, resample)))
+        
+        self.tile_cache[key] = tile
+        if len(self.tile_cache) > TILE_CACHE_SIZE:
+            self.tile_cache.popitem(last=False)
+        return tile
+    
+    def render_view(self):
+        """Draw the visible tiles of the image and the markers for the current viewport"""
+        self.resize_job = None
+        self.canvas.delete("image_tile")
+        
+        level = self.pyramid_index(self.image_scale)
+        level_image = self.pyramid_image(level)
+        level_width, level_height = level_image.size
+        factor = self.image_scale * self.current_image.width / level_width
+        tile_pixels = max(1, round(TILE_SIZE / factor))
+        
+        # Only the tiles overlapping the canvas are decoded and rendered
+        offset_x, offset_y = round(self.image_offset[0]), round(self.image_offset[1])
+        first_x = max(0, int(-offset_x / factor) // tile_pixels)
+        first_y = max(0, int(-offset_y / factor) // tile_pixels)
+        last_x = min(math.ceil(level_width / tile_pixels), int((self.canvas.winfo_width() - offset_x) / factor) // tile_pixels + 1)
+        last_y = min(math.ceil(level_height / tile_pixels), int((self.canvas.winfo_height() - offset_y) / factor) // tile_pixels + 1)
+        
+        self.canvas_image = None
+        for tile_y in range(first_y, last_y):
+            for tile_x in range(first_x, last_x):
+                x0, y0, tile = self.render_tile(level, tile_x, tile_y, tile_pixels)
+                self.canvas_image = self.canvas.create_image(
+                    offset_x + x0, offset_y + y0, anchor=tk.NW, image=tile, tags="image_tile"
+                )
+        
+        self.canvas.tag_lower("image_tile")
+        
+        # Redraw any markers
+        self.redraw_markers()
+    
+    def image_to_canvas(self, x, y):
+        """Canvas coordinates of an image pixel position"""
+        return self.image_offset[0] + x * self.image_scale, self.image_offset[1] + y * self.image_scale
+    
+    def canvas_to_image(self, x, y):
+        """Image pixel position under a canvas point"""
+        return (x - self.image_offset[0]) / self.image_scale, (y - self.image_offset[1]) / self.image_scale
+    
+    def on_zoom(self, event):
+        """Zoom in or out around the mouse cursor"""
+        if not self.current_image:
+            return
+        
+        zoom_in = event.num == 4 or getattr(event, "delta", 0) > 0
+        scale = self.image_scale * (ZOOM_STEP if zoom_in else 1 / ZOOM_STEP)
+        scale = min(max(scale, self.fit_scale / 2), MAX_ZOOM)
+        
+        # Keep the image pixel under the cursor in place
+        x, y = self.canvas_to_image(event.x, event.y)
+        self.image_scale = scale
+        self.image_offset = (event.x - x * scale, event.y - y * scale)
+        self.view_fitted = False
+        self.render_view()
+    
+    def on_pan_start(self, event):
+        """Remember where a pan drag started"""
+        self.pan_start = (event.x, event.y)
+    
+    def on_pan(self, event):
+        """Move the image with the mouse while dragging"""
+        if not self.current_image or self.pan_start is None:
+            return
+        
+        self.image_offset = (self.image_offset[0] + event.x - self.pan_start[0],
+                             self.image_offset[1] + event.y - self.pan_start[1])
+        self.pan_start = (event.x, event.y)
+        self.view_fitted = False
+        self.render_view()
     
     def redraw_markers(self):
         """Redraw markers on the canvas if any exist"""
+        # Redraw distance markers, stored in image coordinates
+        self.canvas.delete("distance_marker_0")
+        self.canvas.delete("distance_marker_1")
+        self.canvas.delete("distance_line")
+        canvas_points = [self.image_to_canvas(x, y) for x, y in self.click_points]
+        for index, (canvas_x, canvas_y) in enumerate(canvas_points):
+            self.canvas.create_oval(canvas_x-5, canvas_y-5, canvas_x+5, canvas_y+5, 
+                                  fill="red", outline="white", tags=f"distance_marker_{index}")
+        if len(canvas_points) == 2:
+            self.canvas.create_line(*canvas_points[0], *canvas_points[1], fill="red", width=2, tags="distance_line")
+        
+        # Clear previous origin marker
+        self.canvas.delete("origin_marker")
+        
         # Redraw origin marker if it exists
         if self.__map_info.get("origin_pixel") is not None:
             x, y = self.__map_info["origin_pixel"]
             
             # Convert to canvas coordinates
-            canvas_x = self.image_offset[0] + x * self.image_scale
-            canvas_y = self.image_offset[1] + y * self.image_scale
-            
-            # Clear previous origin marker
-            self.canvas.delete("origin_marker")
+            canvas_x, canvas_y = self.image_to_canvas(x, y)
             
             # Draw crosshair marker
             size = 10
@@ -218,14 +491,13 @@ class MapImageProcessor(tk.Tk):
         if not self.current_image or not self.canvas_image:
             return
         
-        # Get the actual position on the image
-        x = (event.x - self.image_offset[0]) / self.image_scale
-        y = (event.y - self.image_offset[1]) / self.image_scale  # Fixed: was using image_offset[0] for y
+        # Get the actual position on the image through the current zoom and pan
+        x, y = self.canvas_to_image(event.x, event.y)
         
         if self.click_mode == "origin":
             self.set_origin_point(x, y)
         elif self.click_mode == "meters_per_pixel":
-            self.process_meter_pixel_click(event.x, event.y)
+            self.process_meter_pixel_click(x, y)
     
     def set_meters_per_pixel(self):
         """Start the process of setting meters per pixel by clicking two points"""
@@ -239,39 +511,33 @@ class MapImageProcessor(tk.Tk):
         self.status_bar.config(text="Click on two points to measure distance")
         
     def process_meter_pixel_click(self, x, y):
-        """Process clicks for the meters per pixel calculation"""
-        # Draw a marker at the clicked position
-        marker_id = self.canvas.create_oval(x-5, y-5, x+5, y+5, fill="red", outline="white", tags=f"distance_marker_{self.click_count}")
-        
-        # Store the click point
+        """Process clicks for the meters per pixel calculation, x and y are image pixel coordinates"""
+        # Store the click point, markers follow it through zoom and pan
         self.click_points.append((x, y))
         self.click_count += 1
+        self.redraw_markers()
         
         if self.click_count == 1:
             self.status_bar.config(text="Click on second point")
         elif self.click_count == 2:
-            # Calculate pixel distance between the two points
-            x1, y1 = self.click_points[0]
-            x2, y2 = self.click_points[1]
-            pixel_distance = math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-            
-            # Draw a line between the points
-            self.canvas.create_line(x1, y1, x2, y2, fill="red", width=2, tags="distance_line")
-            
             # Ask user for the real-world distance
             real_distance = simpledialog.askfloat("Distance", 
                                            "Enter the distance in meters:", 
                                            minvalue=0.0001)
             
+            # Reset click mode
+            self.click_mode = None
+            self.click_count = 0
+            
             if real_distance:
-                # Calculate meters per pixel
-                meters_per_pixel = real_distance / (pixel_distance / self.image_scale)
+                # Calculate meters per pixel from the pixel distance between the two points
+                resolution = meters_per_pixel(self.click_points[0], self.click_points[1], real_distance)
                 
                 # Update map_info
-                self.__map_info["resolution"] = meters_per_pixel
-                self.resolution_var.set(f"Resolution: {meters_per_pixel:.6f} meters/pixel")
+                self.__map_info["resolution"] = resolution
+                self.resolution_var.set(f"Resolution: {resolution:.6f} meters/pixel")
                 
-                self.status_bar.config(text=f"Meters per pixel set: {meters_per_pixel:.6f}")
+                self.status_bar.config(text=f"Meters per pixel set: {resolution:.6f}")
                 
                 # Clear the distance markers after a delay (they stay visible long enough for user to see)
                 self.after(2000, self.clear_distance_markers)
@@ -279,12 +545,10 @@ class MapImageProcessor(tk.Tk):
                 # If user canceled, clear markers immediately
                 self.clear_distance_markers()
             
-            # Reset click mode
-            self.click_mode = None
-            self.click_count = 0
-            
     def clear_distance_markers(self):
         """Clear the distance measurement markers"""
+        if self.click_mode != "meters_per_pixel":
+            self.click_points = []
         self.canvas.delete("distance_marker_0")
         self.canvas.delete("distance_marker_1")
         self.canvas.delete("distance_line")
@@ -310,16 +574,8 @@ class MapImageProcessor(tk.Tk):
         # Store the original clicked position for drawing the marker
         clicked_x, clicked_y = x, y
         
-        # Convert from image coordinates to world coordinates
-        # In ROS map_server, origin is in bottom-left corner in world frame
-        # Note: y-axis is inverted in image coordinates
-        img_height = self.current_image.height
-        
-        # Convert pixel coordinates to world coordinates using the ROS map_server convention
-        # The y coordinate needs to be flipped because in image coordinates, 
-        # origin is at top-left, but in ROS coordinates, origin is at bottom-left    
-        world_x = - ((x + 0.5) * self.__map_info["resolution"])
-        world_y = - (((img_height - y) + 0.5) * self.__map_info["resolution"])
+        # Convert from image coordinates to world coordinates using the ROS map_server convention
+        world_x, world_y, _ = origin_from_pixel((x, y), self.current_image.height, self.__map_info["resolution"])
 
         # Update map_info origin
         self.__map_info["origin"] = [world_x, world_y, 0.0]
@@ -328,27 +584,16 @@ class MapImageProcessor(tk.Tk):
         self.origin_var.set(f"Origin: [{world_x:.2f}, {world_y:.2f}, 0.0]")
         
         # Draw a marker at the EXACT clicked position (not at the computed origin)
-        # Convert clicked position to canvas coordinates
-        canvas_x = self.image_offset[0] + clicked_x * self.image_scale
-        canvas_y = self.image_offset[1] + clicked_y * self.image_scale
-        
-        # Clear previous origin marker if exists
-        self.canvas.delete("origin_marker")
-        
-        # Draw crosshair marker at the clicked position
-        size = 10
-        self.canvas.create_line(canvas_x-size, canvas_y, canvas_x+size, canvas_y, 
-                               fill="blue", width=2, tags="origin_marker")
-        self.canvas.create_line(canvas_x, canvas_y-size, canvas_x, canvas_y+size, 
-                               fill="blue", width=2, tags="origin_marker")
-        self.canvas.create_oval(canvas_x-3, canvas_y-3, canvas_x+3, canvas_y+3, 
-                               fill="blue", outline="white", tags="origin_marker")
+        self.redraw_markers()
         
         self.status_bar.config(text=f"Origin set at world coordinates: [{world_x:.2f}, {world_y:.2f}, 0.0]")
         self.click_mode = None
     
     def generate_world(self):
         """Generate the world using the map_info and wall height"""
+        if self.generation_thread is not None:
+            return
+        
         if not self.current_image:
             tk.messagebox.showinfo("Info", "Please load an image first.")
             return
@@ -363,24 +608,95 @@ class MapImageProcessor(tk.Tk):
         # Get script directory
         script_dir = os.path.dirname(os.path.abspath(__file__))
         
-        # Prepare parameters for the process_maps function
-        map_info_list = [self.__map_info]
+        # Prepare parameters for the process_maps function, copied so later clicks cannot change them
+        map_info_list = [dict(self.__map_info)]
         model_dir = script_dir
         world_dir = script_dir
         
-        # Call the process_maps function
-        process_maps(map_info_list, model_dir, world_dir, wall_height)
+        # Run the process_maps function off the Tk thread so the window stays responsive
+        self.cancel_event.clear()
+        self.generate_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.status_bar.config(text=f"Generating {self.__map_info['map_name']}...")
+        
+        self.generation_thread = threading.Thread(
+            target=self.run_generation, args=(map_info_list, model_dir, world_dir, wall_height), daemon=True
+        )
+        self.generation_thread.start()
+        self.after(GENERATION_POLL_MS, self.poll_generation)
+    
+    def run_generation(self, map_info_list, model_dir, world_dir, wall_height):
+        """Call process_maps on the worker thread and queue the outcome"""
+        try:
+            success_count, fail_count = process_maps(
+                map_info_list, model_dir, world_dir, wall_height, progress=self.report_progress
+            )
+        except ConversionCancelled:
+            self.generation_queue.put(("cancelled", None))
+        except Exception as e:
+            self.generation_queue.put(("error", str(e)))
+        else:
+            self.generation_queue.put(("done", (success_count, fail_count)))
+    
+    def report_progress(self, map_name, stage):
+        """Progress callback of process_maps, runs on the worker thread"""
+        # A finished map is already written and cached, so Cancel only stops the stages before it
+        if self.cancel_event.is_set() and stage != PROGRESS_DONE:
+            raise ConversionCancelled()
         
-        tk.messagebox.showinfo("Success", "World generation complete!")
+        self.generation_queue.put(("progress", f"Generating {map_name}: {stage}"))
+    
+    def poll_generation(self):
+        """Show queued progress in the status bar until the worker finishes"""
+        while True:
+            try:
+                kind, value = self.generation_queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if kind == "progress":
+                self.status_bar.config(text=value)
+            else:
+                self.finish_generation(kind, value)
+                return
+        
+        self.after(GENERATION_POLL_MS, self.poll_generation)
+    
+    def finish_generation(self, kind, value):
+        """Restore the controls and report how the generation ended"""
+        self.generation_thread = None
+        self.generate_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        
+        if kind == "cancelled":
+            self.status_bar.config(text="World generation cancelled")
+        elif kind == "error":
+            self.status_bar.config(text="World generation failed")
+            tk.messagebox.showerror("Error", f"World generation failed: {value}")
+        elif value[1]:
+            self.status_bar.config(text="World generation failed")
+            tk.messagebox.showerror("Error", "World generation failed, see the console output for details.")
+        else:
+            self.status_bar.config(text="World generation complete")
+            tk.messagebox.showinfo("Success", "World generation complete!")
+    
+    def cancel_generation(self):
+        """Ask the running generation to stop at its next progress report"""
+        if self.generation_thread is not None:
+            self.cancel_event.set()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status_bar.config(text="Cancelling world generation...")
     
     def on_resize(self, event):
-        """Handle window resize events"""
+        """Handle canvas resize events, redrawing once the resizing settles"""
         if self.current_image:
-            # Redisplay the image to fit the new canvas size
-            self.after(100, self.display_image)
+            # Dragging the window fires a burst of events, only the last one redisplays the image
+            if self.resize_job is not None:
+                self.after_cancel(self.resize_job)
+            # A zoomed or panned view keeps its viewport, only a fitted one is refitted
+            redraw = self.display_image if self.view_fitted else self.render_view
+            self.resize_job = self.after(RESIZE_DEBOUNCE_MS, redraw)
 
 if __name__ == "__main__":
     app = MapImageProcessor()
-    # Bind resize event
-    app.bind("<Configure>", app.on_resize)
     app.mainloop()
@@ -3,8 +3,19 @@ import numpy as np
 import trimesh
 import yaml
 import argparse
+import hashlib
+import importlib.util
+import json
 import os
+import resource
+import shutil
+import struct
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
+from itertools import repeat
 
 
 XML_MODEL_CONFIG_TEMPLATE = """
@@ -23,6 +34,7 @@ XML_MODEL_CONFIG_TEMPLATE = """
 
 XML_MODEL_TEMPLATE = """
     <model name="{name}">
+      <pose>{pose}</pose>
       <link name="link">
         <inertial>
           <mass>15</mass>
@@ -39,15 +51,21 @@ XML_MODEL_TEMPLATE = """
           <pose>0 0 0 0 0 0</pose>
           <geometry>
             <mesh>
-              <uri>model://{name}/meshes/{name}.stl</uri>
+              <uri>model://{name}/meshes/{collision_mesh}.stl</uri>
             </mesh>
           </geometry>
-        </collision>
+        </collision>{visual}
+      </link>
+      <static>1</static>
+    </model>
+"""
+
+XML_VISUAL_TEMPLATE = """
         <visual name="visual">
           <pose>0 0 0 0 0 0</pose>
           <geometry>
             <mesh>
-              <uri>model://{name}/meshes/{name}.stl</uri>
+              <uri>model://{name}/meshes/{visual_mesh}.stl</uri>
             </mesh>
           </geometry>
           <material>
@@ -56,12 +74,54 @@ XML_MODEL_TEMPLATE = """
             <specular>0.5 0.5 0.5 1</specular>
             <emissive>0 0 0 1</emissive>
           </material>
-        </visual>
+        </visual>"""
+
+XML_BOX_MODEL_TEMPLATE = """
+    <model name="{name}">
+      <pose>{pose}</pose>
+      <link name="link">
+        <inertial>
+          <mass>15</mass>
+          <inertia>
+            <ixx>0.0</ixx>
+            <ixy>0.0</ixy>
+            <ixz>0.0</ixz>
+            <iyy>0.0</iyy>
+            <iyz>0.0</iyz>
+            <izz>0.0</izz>
+          </inertia>
+        </inertial>{boxes}
       </link>
       <static>1</static>
     </model>
 """
 
+XML_BOX_COLLISION_TEMPLATE = """
+        <collision name="collision_{index}">
+          <pose>{x:.6f} {y:.6f} {z:.6f} 0 0 0</pose>
+          <geometry>
+            <box>
+              <size>{size_x:.6f} {size_y:.6f} {size_z:.6f}</size>
+            </box>
+          </geometry>
+        </collision>"""
+
+XML_BOX_VISUAL_TEMPLATE = """
+        <visual name="visual_{index}">
+          <pose>{x:.6f} {y:.6f} {z:.6f} 0 0 0</pose>
+          <geometry>
+            <box>
+              <size>{size_x:.6f} {size_y:.6f} {size_z:.6f}</size>
+            </box>
+          </geometry>
+          <material>
+            <ambient>1 1 1 1</ambient>
+            <diffuse>1 1 1 1</diffuse>
+            <specular>0.5 0.5 0.5 1</specular>
+            <emissive>0 0 0 1</emissive>
+          </material>
+        </visual>"""
+
 XML_SDF_TEMPLATE = """
 <?xml version="1.0" ?>
 <sdf version="1.4">
@@ -141,58 +201,1046 @@ XML_WORLD_TEMPLATE="""
 </sdf>
 """
 
-def create_mesh_from_map(map_array, metadata, height=1.5):
+# Triangles of the box extruded from one cell, indexing its 4 floor corners
+# (x0y0, x0y1, x1y0, x1y1) followed by the same 4 corners raised to the height
+BOX_FACES = np.array([[0, 2, 4], [4, 2, 6], [1, 2, 0], [3, 2, 1],
+                      [5, 0, 4], [1, 0, 5], [3, 7, 2], [7, 6, 2],
+                      [7, 4, 6], [5, 4, 7], [1, 5, 3], [7, 3, 5]])
+
+MESHERS = ('loop', 'numpy', 'greedy', 'contour')
+
+# Internal mesher of --collision-mesh: contours grown by the tolerance before simplifying
+COLLISION_MESHER = 'collision'
+
+# Modules trimesh can triangulate extruded contour caps with, any one of them is enough
+TRIANGULATION_ENGINES = ('mapbox_earcut', 'manifold3d', 'triangle')
+
+DEFAULT_OPTIONS = {
+    'mesher': 'numpy',
+    'tolerance': 0.0,
+    'validate': False,
+    'tile_size': None,
+    'mesh_jobs': 1,
+    'force': False,
+    'unknown': 'wall',
+    'crop': True,
+    'profile': False,
+    'geometry': 'mesh',
+    'collision_mesh': False,
+    'collision_tolerance': 0.025,
+    'collision_margin': 0.0,
+    'headless': False,
+    'lod_levels': None,
+    'world_lod': 1,
+    'incremental': False,
+}
+
+GEOMETRIES = ('mesh', 'boxes')
+
+UNKNOWN_POLICIES = ('wall', 'free', 'frontier')
+
+# Pixel classes of the thresholding lookup table
+PIXEL_FREE, PIXEL_UNKNOWN, PIXEL_OCCUPIED = 0, 1, 2
+
+# Bytes read to parse a PGM header, room for the comments map savers write
+PGM_HEADER_BYTES = 4096
+
+# Options that change how fast a map is converted but not what is written
+CACHE_IGNORED_OPTIONS = ('mesh_jobs', 'force', 'profile')
+
+# Map YAML fields that affect the generated model
+CACHE_MAP_FIELDS = ('resolution', 'origin', 'negate', 'occupied_thresh', 'free_thresh')
+
+# Bump when a change to this script alters the output for the same inputs
+CACHE_VERSION = 6
+
+CACHE_DIR = '.map2gazebo_cache'
+
+PROFILE_DIR = '.map2gazebo_profile'
+
+# Per-mesh tile cache of --incremental, hidden inside the model directory so it is never installed
+TILE_CACHE_DIR = '.map2gazebo_tiles'
+
+# Edge length in cells of the tiles --incremental meshes and caches independently
+TILE_CACHE_CELLS = 128
+
+# Upper bound on the cells (or merged boxes) meshed and written per STL chunk
+STL_CHUNK_CELLS = 1 << 15
+
+# Binary STL header: 80 bytes of text followed by the triangle count
+STL_HEADER_BYTES = 84
+
+# Binary STL triangle record: normal, 3 vertices, attribute byte count
+STL_TRIANGLE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attributes', '<u2')])
+
+def peak_rss_mb():
+    # VmHWM is the peak resident set since the process started or reset_peak_rss last ran
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+
+    # ru_maxrss is in kilobytes on Linux and cannot be reset
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs brings VmHWM down to the current RSS, False where the kernel does not allow it
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+# Stage reported to the progress callback once a map is written, too late to cancel it
+PROGRESS_DONE = 'done'
+
+class ConversionCancelled(Exception):
+    # Raised by a progress callback to abort the conversion, process_maps lets it through
+    pass
+
+class StageProfiler:
+    def __init__(self, progress=None):
+        self.stages = {}
+        self.counts = {}
+        self.progress = progress
+        # 'map' once reset_peak_rss succeeded, otherwise the peaks include everything the process ran before
+        self.peak_rss_scope = 'process'
+
+    def reset_peak_rss(self):
+        if reset_peak_rss():
+            self.peak_rss_scope = 'map'
+
+    def notify(self, name):
+        # Reports the running stage to the progress callback, which may raise ConversionCancelled
+        if self.progress is not None:
+            self.progress(name)
+
+    @contextmanager
+    def stage(self, name):
+        self.notify(name)
+        if self.peak_rss_scope == 'map':
+            # Each stage measures its own peak instead of the highest RSS of the map so far
+            reset_peak_rss()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Stages that run once per tile add up under the same name, keeping the peak of the largest call
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'peak_rss_mb': 0.0})
+            stage['seconds'] += time.perf_counter() - start_time
+            stage['calls'] += 1
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'], peak_rss_mb())
+
+    def count(self, **counts):
+        for name, value in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + int(value)
+
+    def report(self, map_name):
+        return {
+            'map_name': map_name,
+            'total_seconds': sum(stage['seconds'] for stage in self.stages.values()),
+            'peak_rss_mb': max((stage['peak_rss_mb'] for stage in self.stages.values()), default=peak_rss_mb()),
+            'peak_rss_scope': self.peak_rss_scope,
+            'stages': self.stages,
+            'counts': self.counts,
+        }
+
+def profile_report_path(export_dir, map_name):
+    return os.path.join(export_dir, PROFILE_DIR, f'{map_name}.json')
+
+def write_profile_report(export_dir, map_name, profiler):
+    report_path = profile_report_path(export_dir, map_name)
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+
+    with open(report_path, 'w') as f:
+        json.dump(profiler.report(map_name), f, indent=2)
+
+    print(f'Profile report for {map_name}: {report_path}')
+
+def print_profile_summary(export_dir, map_names):
+    print(f"{'map':<24} {'total s':>9} {'slowest stage':>20} {'peak RSS MB':>12} "
+          f"{'pixels':>11} {'cells':>11} {'faces':>11} {'bytes':>13}")
+    for map_name in map_names:
+        report_path = profile_report_path(export_dir, map_name)
+        if not os.path.exists(report_path):
+            continue
+
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+
+        counts = report['counts']
+        slowest = max(report['stages'], key=lambda name: report['stages'][name]['seconds'], default='-')
+        # A process high-water mark would repeat the peak of an earlier map, so it is left out
+        peak_rss = f"{report['peak_rss_mb']:.1f}" if report.get('peak_rss_scope') == 'map' else '-'
+        print(f"{map_name:<24} {report['total_seconds']:>9.2f} {slowest:>20} {peak_rss:>12} "
+              f"{counts.get('pixels', 0):>11} {counts.get('occupied_cells', 0):>11} "
+              f"{counts.get('faces', 0):>11} {counts.get('bytes_written', 0):>13}")
+
+def read_pgm_header(header):
+    # Width, height, maxval and the pixel offset of a binary (P5) PGM, or None for anything else
+    if not header.startswith(b'P5'):
+        return None
+
+    tokens = []
+    position = 2
+    while len(tokens) < 3:
+        if position >= len(header):
+            return None
+        if header[position:position + 1] == b'#':
+            position = header.find(b'\n', position)
+            if position < 0:
+                return None
+        elif header[position:position + 1].isspace():
+            position += 1
+        else:
+            end = position
+            while header[end:end + 1].isdigit():
+                end += 1
+            if end == position:
+                return None
+            tokens.append(int(header[position:end]))
+            position = end
+
+    # A single whitespace byte separates the header from the pixels
+    return tokens[0], tokens[1], tokens[2], position + 1
+
+def load_map_image(image_path):
+    # Grayscale pixels with the bottom row first, as a read-only view wherever possible
+    with open(image_path, 'rb') as f:
+        header = read_pgm_header(f.read(PGM_HEADER_BYTES))
+
+    if header is not None and header[2] == 255:
+        width, height, _, offset = header
+        # Memory mapped, so the pixels are paged in from the file instead of copied
+        map_array = np.memmap(image_path, dtype=np.uint8, mode='r', offset=offset, shape=(height, width))
+    else:
+        # PNG and 16-bit PGM maps are decoded by OpenCV straight to one channel
+        map_array = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if map_array is None:
+            return None
+        map_array.flags.writeable = False
+
+    return map_array[::-1]
+
+def pixel_classes(metadata):
+    # Class of each of the 256 pixel values from its occupancy probability, as map_server reads it
+    values = np.arange(256)
+    if metadata.get('negate', 0):
+        probability = values / 255.0
+    else:
+        probability = (255 - values) / 255.0
+
+    classes = np.full(256, PIXEL_UNKNOWN, dtype=np.uint8)
+    classes[probability > metadata['occupied_thresh']] = PIXEL_OCCUPIED
+    classes[probability < metadata['free_thresh']] = PIXEL_FREE
+    return classes
+
+def wall_map(map_array, metadata, unknown='wall', crop=True):
+    if unknown not in UNKNOWN_POLICIES:
+        raise ValueError(f"Unknown policy '{unknown}', expected one of {UNKNOWN_POLICIES}")
+
+    classes = pixel_classes(metadata)
+    # The uncropped grid stays on record, so --incremental can place its tiles independently of the crop
+    metadata = dict(metadata, origin=list(metadata['origin']), uncropped_origin=list(metadata['origin'][:2]),
+                    uncropped_shape=list(map_array.shape))
+
+    if crop:
+        # Bounding box of the known pixels plus one pixel, so unknown walls still close it off. The far
+        # edges keep one more pixel because occupied_cells drops the last row and column of the map
+        known = (classes != PIXEL_UNKNOWN)[map_array]
+        known_rows = np.flatnonzero(known.any(axis=1))
+        known_cols = np.flatnonzero(known.any(axis=0))
+        del known
+
+        if len(known_rows):
+            y0, y1 = max(int(known_rows[0]) - 1, 0), min(int(known_rows[-1]) + 3, map_array.shape[0])
+            x0, x1 = max(int(known_cols[0]) - 1, 0), min(int(known_cols[-1]) + 3, map_array.shape[1])
+            map_array = map_array[y0:y1, x0:x1]
+            metadata['origin'][0] += x0 * metadata['resolution']
+            metadata['origin'][1] += y0 * metadata['resolution']
+
+    if unknown == 'frontier':
+        # Unknown pixels only become walls where they touch free space
+        pixels = classes[map_array]
+        near_free = cv2.dilate((pixels == PIXEL_FREE).astype(np.uint8), np.ones((3, 3), np.uint8)).astype(bool)
+        walls = (pixels == PIXEL_OCCUPIED) | ((pixels == PIXEL_UNKNOWN) & near_free)
+        return np.where(walls, 0, 255).astype(np.uint8), metadata
+
+    # Walls become 0 and free space 255 in a single lookup over the pixels
+    free_classes = (PIXEL_FREE, PIXEL_UNKNOWN) if unknown == 'free' else (PIXEL_FREE,)
+    walls = np.where(np.isin(classes, free_classes), 255, 0).astype(np.uint8)
+    return walls[map_array], metadata
+
+def occupied_cells(map_array, metadata):
+    # Pixels at or below the free threshold are walls in a thresholded map (wall_map writes 0 for them)
+    occupied = np.arange(256) <= metadata["free_thresh"] * 255
+
+    # A cell spans from its pixel to the next one, so the last row and column never start a cell
+    return occupied[map_array[:-1, :-1]]
+
+def mesh_arrays_loop(occupied, metadata, height=1.5):
     height_vector = np.array([0, 0, height])
     vertices = []
     faces = []
     vertex_count = 0
 
-    thresh_map = map_array.copy()
-
-    # Apply the thresholds
-    thresh_map[map_array >= metadata["occupied_thresh"] * 255] = 255  # Occupied cells
-    thresh_map[map_array <= metadata["free_thresh"] * 255] = 0  # Free cells
-    thresh_map[(map_array > metadata["free_thresh"] * 255) & (map_array < metadata["occupied_thresh"] * 255)] = 127  # Unknown cells
-
-    # Reduce resolution to simplify the mesh
-    step = 1  # Adjust this value to change the simplification level
-
-    for y in range(0, thresh_map.shape[0] - 1, step):
-        for x in range(0, thresh_map.shape[1] - 1, step):
-            if thresh_map[y, x] == 0:  # If the pixel is black (occupied)
+    # Coarser meshes come from aggregate_cells (--lod-levels), so every cell is meshed here
+    for y in range(occupied.shape[0]):
+        for x in range(occupied.shape[1]):
+            if occupied[y, x]:  # If the pixel is black (occupied)
                 new_vertices = [
                     coords_to_loc((x, y), metadata),
-                    coords_to_loc((x, y+step), metadata),
-                    coords_to_loc((x+step, y), metadata),
-                    coords_to_loc((x+step, y+step), metadata)
+                    coords_to_loc((x, y+1), metadata),
+                    coords_to_loc((x+1, y), metadata),
+                    coords_to_loc((x+1, y+1), metadata)
                 ]
                 vertices.extend(new_vertices)
                 vertices.extend([v + height_vector for v in new_vertices])
 
                 new_faces = [
                     [vertex_count + i for i in face]
-                    for face in [[0, 2, 4], [4, 2, 6], [1, 2, 0], [3, 2, 1],
-                                [5, 0, 4], [1, 0, 5], [3, 7, 2], [7, 6, 2],
-                                [7, 4, 6], [5, 4, 7], [1, 5, 3], [7, 3, 5]]
+                    for face in BOX_FACES.tolist()
                 ]
                 faces.extend(new_faces)
                 vertex_count += 8
 
-    mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
-    if not mesh.is_volume:
-        mesh.fix_normals()
+    return np.array(vertices, dtype=np.float64).reshape(-1, 3), np.array(faces, dtype=np.int64).reshape(-1, 3)
+
+def box_arrays(x0, y0, x1, y1, metadata, height=1.5):
+    # Same vertex layout and arithmetic as coords_to_loc, evaluated for all boxes at once
+    corners_x = np.stack([x0, x0, x1, x1], axis=1) * metadata['resolution'] + metadata['origin'][0]
+    corners_y = np.stack([y0, y1, y0, y1], axis=1) * metadata['resolution'] + metadata['origin'][1]
+
+    vertices = np.empty((len(corners_x), 8, 3), dtype=np.float64)
+    vertices[:, :4, 0] = corners_x
+    vertices[:, 4:, 0] = corners_x
+    vertices[:, :4, 1] = corners_y
+    vertices[:, 4:, 1] = corners_y
+    vertices[:, :4, 2] = 0.0
+    vertices[:, 4:, 2] = 0.0 + height
+
+    faces = np.arange(len(corners_x), dtype=np.int64)[:, None, None] * 8 + BOX_FACES
+    return vertices.reshape(-1, 3), faces.reshape(-1, 3)
+
+def mesh_arrays_numpy(occupied, metadata, height=1.5):
+    # np.nonzero walks the grid row by row, the same order as the loop mesher
+    ys, xs = np.nonzero(occupied)
+    return box_arrays(xs, ys, xs + 1, ys + 1, metadata, height)
+
+def row_runs(occupied, row_offset=0):
+    # Horizontal runs of occupied cells, found for every row at once
+    padded = np.pad(occupied, ((0, 0), (1, 1))).astype(np.int8)
+    edges = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)
+    return run_rows + row_offset, run_starts, run_ends
+
+def band_rectangles(occupied_band, row_offset=0):
+    run_rows, run_starts, run_ends = row_runs(occupied_band)
+    row_bounds = np.searchsorted(run_rows, np.arange(occupied_band.shape[0] + 1)).tolist()
+    run_starts = run_starts.tolist()
+    run_ends = run_ends.tolist()
+
+    # Grow each run downwards for as long as the next row has a run with the same span
+    rectangles = []
+    open_rectangles = {}  # (x0, x1) -> y0
+    for y in range(occupied_band.shape[0] + 1):
+        if y < occupied_band.shape[0]:
+            runs = set(zip(run_starts[row_bounds[y]:row_bounds[y + 1]], run_ends[row_bounds[y]:row_bounds[y + 1]]))
+        else:
+            runs = set()
+
+        for span in [span for span in open_rectangles if span not in runs]:
+            rectangles.append((span[0], open_rectangles.pop(span), span[1], y))
+
+        for span in runs:
+            if span not in open_rectangles:
+                open_rectangles[span] = y
+
+    rectangles = np.array(rectangles, dtype=np.int64).reshape(-1, 4)
+    rectangles[:, [1, 3]] += row_offset
+    return rectangles
+
+def stitch_bands(bands, offsets, rows):
+    # A rectangle closed by the bottom of its band continues into the next band's rectangle
+    # that starts on the seam with the same span, exactly as one scan over every row would grow it
+    keep = [np.ones(len(rectangles), dtype=bool) for rectangles in bands]
+    carry = {}  # (x0, x1) -> (band, index) of the rectangles reaching the current seam
+    for band, (rectangles, y0) in enumerate(zip(bands, offsets)):
+        for index in np.nonzero(rectangles[:, 1] == y0)[0].tolist():
+            previous = carry.get((int(rectangles[index, 0]), int(rectangles[index, 2])))
+            if previous is not None:
+                rectangles[index, 1] = bands[previous[0]][previous[1], 1]
+                keep[previous[0]][previous[1]] = False
+
+        carry = {
+            (int(rectangles[index, 0]), int(rectangles[index, 2])): (band, index)
+            for index in np.nonzero(rectangles[:, 3] == y0 + rows)[0].tolist()
+        }
+
+    return np.concatenate([rectangles[kept] for rectangles, kept in zip(bands, keep)])
+
+def merge_rectangles(occupied, jobs=1, executor=None):
+    if jobs > 1 and occupied.shape[0] > 1:
+        # Bands are merged in parallel and their rectangles joined across the seams below
+        rows = -(-occupied.shape[0] // jobs)
+        offsets = range(0, occupied.shape[0], rows)
+        bands = [occupied[y0:y0 + rows] for y0 in offsets]
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                band_list = list(executor.map(band_rectangles, bands, offsets))
+        else:
+            band_list = list(executor.map(band_rectangles, bands, offsets))
+        rectangles = stitch_bands(band_list, offsets, rows)
+    else:
+        rectangles = band_rectangles(occupied)
+
+    # Row-major order of the top-left corner keeps the output deterministic
+    rectangles = rectangles[np.lexsort((rectangles[:, 0], rectangles[:, 1]))]
+    return rectangles[:, 0], rectangles[:, 1], rectangles[:, 2], rectangles[:, 3]
+
+def mesh_arrays_greedy(occupied, metadata, height=1.5):
+    return box_arrays(*merge_rectangles(occupied), metadata, height)
+
+def outline_polygons(occupied, metadata, tolerance=0.0):
+    # Trace the mask at twice its resolution so that every traced subpixel center
+    # sits a quarter cell inside an edge and maps back onto that edge with // 2
+    upsampled = np.repeat(np.repeat(occupied, 2, axis=0), 2, axis=1)
+    upsampled = np.pad(upsampled, 1).astype(np.uint8)
+    contours, hierarchy = cv2.findContours(upsampled, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_NONE)
+    if not contours:
+        return []
+
+    epsilon = tolerance / metadata['resolution']
+    traced_rings = []
+    rings = []
+    for contour in contours:
+        points = contour.reshape(-1, 2) // 2
+        points = points[np.any(points != np.roll(points, 1, axis=0), axis=1)]
+        # Douglas-Peucker, in cell units
+        simplified = cv2.approxPolyDP(points.astype(np.float32).reshape(-1, 1, 2), epsilon, True).reshape(-1, 2)
+        if len(simplified) < 3:
+            # Components smaller than the tolerance would vanish, they keep their traced outline
+            simplified = points
+        traced_rings.append(points.astype(np.float64) * metadata['resolution'] + metadata['origin'][:2])
+        rings.append(simplified.astype(np.float64) * metadata['resolution'] + metadata['origin'][:2])
+
+    # RETR_CCOMP gives outer boundaries (no parent) and the holes directly inside them
+    polygons = []
+    for i, (_, _, child, parent) in enumerate(hierarchy[0]):
+        if parent != -1:
+            continue
+
+        children = []
+        while child != -1:
+            children.append(child)
+            child = hierarchy[0][child][0]
+
+        polygon = ring_polygon(rings[i], [rings[child] for child in children])
+        if polygon.is_empty or polygon.area <= 0:
+            # Simplification flattened the whole obstacle, keep it as traced instead of dropping it
+            polygon = ring_polygon(traced_rings[i], [traced_rings[child] for child in children])
+        polygons.extend(getattr(polygon, 'geoms', [polygon]))
+
+    return [polygon for polygon in polygons if not polygon.is_empty and polygon.area > 0]
+
+def ring_polygon(shell, holes):
+    from shapely.geometry import Polygon
+
+    polygon = Polygon(shell, holes)
+    if not polygon.is_valid:
+        # Simplification and diagonal steps can pinch a ring, buffer(0) untangles it
+        polygon = polygon.buffer(0)
+    return polygon
+
+def covering_polygons(occupied, metadata, tolerance=0.0):
+    from shapely.geometry import JOIN_STYLE
+    from shapely.ops import unary_union
+
+    # Simplified outlines that must contain every occupied cell: the exact cell outlines are grown
+    # by the tolerance before simplifying, so simplification mostly cuts into the added margin
+    polygons = outline_polygons(occupied, metadata)
+    if tolerance <= 0 or not polygons:
+        return polygons
+
+    exact = unary_union(polygons)
+    # Topology preserving simplification never reduces a ring below a triangle
+    simplified = exact.buffer(tolerance, join_style=JOIN_STYLE.mitre).simplify(tolerance, preserve_topology=True)
+    if not simplified.covers(exact):
+        # Corners cut deeper than the margin get their cells back
+        simplified = simplified.union(exact)
+    return [polygon for polygon in getattr(simplified, 'geoms', [simplified]) if not polygon.is_empty]
+
+def triangulation_error(options):
+    # The contour and collision meshers extrude polygons, which trimesh cannot do without a triangulation engine
+    options = dict(DEFAULT_OPTIONS, **options)
+    if options['geometry'] != 'mesh' or (options['mesher'] != 'contour' and not options['collision_mesh']):
+        return None
+    if any(importlib.util.find_spec(module) is not None for module in TRIANGULATION_ENGINES):
+        return None
+
+    feature = '--collision-mesh' if options['collision_mesh'] else '--mesher contour'
+    return (f"{feature} needs a polygon triangulation engine, install one of {', '.join(TRIANGULATION_ENGINES)} "
+            f"(e.g. pip install mapbox-earcut)")
+
+def mesh_arrays_contour(occupied, metadata, height=1.5, tolerance=0.0, covering=False):
+    vertices = []
+    faces = []
+    vertex_count = 0
+
+    # Only the outline walls and the triangulated caps, no faces between neighbouring cells
+    polygons = covering_polygons if covering else outline_polygons
+    for polygon in polygons(occupied, metadata, tolerance):
+        prism = trimesh.creation.extrude_polygon(polygon, height)
+        vertices.append(prism.vertices)
+        faces.append(prism.faces + vertex_count)
+        vertex_count += len(prism.vertices)
+
+    if not vertices:
+        return np.empty((0, 3), dtype=np.float64), np.empty((0, 3), dtype=np.int64)
+
+    return np.concatenate(vertices), np.concatenate(faces)
+
+def mesh_cells(occupied, metadata, height=1.5, mesher='numpy', tolerance=0.0):
+    if mesher == 'loop':
+        return mesh_arrays_loop(occupied, metadata, height)
+    if mesher == 'numpy':
+        return mesh_arrays_numpy(occupied, metadata, height)
+    if mesher == 'greedy':
+        return mesh_arrays_greedy(occupied, metadata, height)
+    if mesher == 'contour':
+        return mesh_arrays_contour(occupied, metadata, height, tolerance)
+    if mesher == COLLISION_MESHER:
+        return mesh_arrays_contour(occupied, metadata, height, tolerance, covering=True)
+
+    raise ValueError(f"Unknown mesher '{mesher}', expected one of {MESHERS}")
+
+def create_mesh_arrays(map_array, metadata, height=1.5, mesher='numpy', tolerance=0.0):
+    return mesh_cells(occupied_cells(map_array, metadata), metadata, height, mesher, tolerance)
+
+def mesh_from_arrays(vertices, faces, profiler=None):
+    profiler = profiler or StageProfiler()
+
+    with profiler.stage('trimesh'):
+        mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
+        is_volume = mesh.is_volume
+
+    with profiler.stage('fix_normals'):
+        if not is_volume:
+            mesh.fix_normals()
     
-    mesh.update_faces(mesh.unique_faces())
+    with profiler.stage('unique_faces'):
+        mesh.update_faces(mesh.unique_faces())
     
     return mesh
 
+def create_mesh_from_map(map_array, metadata, height=1.5, mesher='numpy', tolerance=0.0):
+    return mesh_from_arrays(*create_mesh_arrays(map_array, metadata, height, mesher, tolerance))
+
+def band_rows(occupied):
+    # Rows per band so that a band holds at most STL_CHUNK_CELLS cells
+    return max(1, STL_CHUNK_CELLS // max(1, occupied.shape[1]))
+
+def mesh_band(occupied_band, row_offset, metadata, height=1.5, records=False):
+    ys, xs = np.nonzero(occupied_band)
+    ys += row_offset
+    vertices, faces = box_arrays(xs, ys, xs + 1, ys + 1, metadata, height)
+    return stl_records(vertices, faces) if records else (vertices, faces)
+
+def mesh_rectangles(x0, y0, x1, y1, metadata, height=1.5, records=False):
+    vertices, faces = box_arrays(x0, y0, x1, y1, metadata, height)
+    return stl_records(vertices, faces) if records else (vertices, faces)
+
+def iter_mesh_chunks(occupied, metadata, height=1.5, mesher='numpy', tolerance=0.0, jobs=1, records=False):
+    # Yields (vertices, faces) chunks, or their binary STL records when records is set
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+
+    if mesher == 'numpy':
+        # Bands are yielded top to bottom, the same order as mesh_arrays_numpy
+        rows = band_rows(occupied)
+        offsets = range(0, occupied.shape[0], rows)
+        if jobs == 1 or len(offsets) == 1:
+            for y0 in offsets:
+                yield mesh_band(occupied[y0:y0 + rows], y0, metadata, height, records)
+            return
+
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # Keep only a few bands per worker in flight so memory stays bounded
+            window = 4 * jobs
+            for i in range(0, len(offsets), window):
+                window_offsets = offsets[i:i + window]
+                bands = [occupied[y0:y0 + rows] for y0 in window_offsets]
+                yield from executor.map(
+                    mesh_band, bands, window_offsets, repeat(metadata), repeat(height), repeat(records)
+                )
+        return
+
+    if mesher == 'greedy':
+        if jobs == 1:
+            sides = merge_rectangles(occupied)
+            for i in range(0, len(sides[0]), STL_CHUNK_CELLS):
+                yield mesh_rectangles(*(side[i:i + STL_CHUNK_CELLS] for side in sides), metadata, height, records)
+            return
+
+        # The same workers merge the bands and then encode the boxes, chunk by chunk
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            sides = merge_rectangles(occupied, jobs, executor)
+            starts = range(0, len(sides[0]), STL_CHUNK_CELLS)
+            window = 4 * jobs
+            for i in range(0, len(starts), window):
+                window_starts = starts[i:i + window]
+                chunk_sides = ([side[start:start + STL_CHUNK_CELLS] for start in window_starts] for side in sides)
+                yield from executor.map(
+                    mesh_rectangles, *chunk_sides, repeat(metadata), repeat(height), repeat(records)
+                )
+        return
+
+    vertices, faces = mesh_cells(occupied, metadata, height, mesher, tolerance)
+    yield stl_records(vertices, faces) if records else (vertices, faces)
+
+def concatenate_chunks(chunks):
+    vertices = []
+    faces = []
+    vertex_count = 0
+
+    # Faces of each chunk index its own vertices, shift them past the chunks before it
+    for chunk_vertices, chunk_faces in chunks:
+        vertices.append(chunk_vertices)
+        faces.append(chunk_faces + vertex_count)
+        vertex_count += len(chunk_vertices)
+
+    if not vertices:
+        return np.empty((0, 3), dtype=np.float64), np.empty((0, 3), dtype=np.int64)
+
+    return np.concatenate(vertices), np.concatenate(faces)
+
+def stl_records(vertices, faces):
+    triangles = vertices[faces]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+
+    records = np.zeros(len(faces), dtype=STL_TRIANGLE)
+    records['normal'] = normals
+    records['vertices'] = triangles
+    return records
+
+def notify_chunks(chunks, profiler, stage):
+    # Long meshing stages report every chunk, so a cancel request is noticed mid-stage
+    for chunk in chunks:
+        profiler.notify(stage)
+        yield chunk
+
+def write_binary_stl(stl_path, record_chunks):
+    triangle_count = 0
+    with open(stl_path, 'wb') as f:
+        f.write(b'map2gazebo'.ljust(80, b' '))
+        f.write(struct.pack('<I', 0))
+
+        for records in record_chunks:
+            f.write(records.tobytes())
+            triangle_count += len(records)
+
+        # The triangle count is only known once every chunk has been written
+        f.seek(80)
+        f.write(struct.pack('<I', triangle_count))
+
+    return triangle_count
+
+def report_triangles(map_name, occupied, triangle_count):
+    # Every occupied cell costs 12 triangles when meshed on its own
+    per_cell = 12 * int(np.count_nonzero(occupied))
+    reduction = per_cell / triangle_count if triangle_count else 1.0
+    print(f'Mesh for {map_name}: {triangle_count} triangles, {per_cell} per-cell ({reduction:.1f}x reduction)')
+
 def coords_to_loc(coords, metadata):
     x, y = coords
     loc_x = x * metadata['resolution'] + metadata['origin'][0]
     loc_y = y * metadata['resolution'] + metadata['origin'][1]
     return np.array([loc_x, loc_y, 0.0])
 
-def process_map(map_info, export_dir, world_dir, height=1.5):
+def cache_key(map_info, export_dir, world_dir, height, options):
+    digest = hashlib.sha256()
+    with open(map_info['image'], 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    settings = {
+        'version': CACHE_VERSION,
+        'map': {field: map_info.get(field) for field in CACHE_MAP_FIELDS},
+        # Outputs written to other directories are not the ones the manifest lists
+        'model_dir': os.path.abspath(export_dir),
+        'world_dir': os.path.abspath(world_dir),
+        'height': height,
+        'options': {key: value for key, value in options.items() if key not in CACHE_IGNORED_OPTIONS},
+    }
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def cache_manifest_path(export_dir, map_name):
+    # One manifest per map, so maps converted in parallel never write the same file
+    return os.path.join(export_dir, CACHE_DIR, f'{map_name}.json')
+
+def is_cached(export_dir, map_name, key):
+    manifest_path = cache_manifest_path(export_dir, map_name)
+    if not os.path.exists(manifest_path):
+        return False
+
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if manifest.get('key') != key:
+        return False
+
+    # Outputs deleted by hand since the last run must be regenerated
+    return all(os.path.exists(path) for path in manifest.get('outputs', []))
+
+def remove_cache_manifest(export_dir, map_name):
+    manifest_path = cache_manifest_path(export_dir, map_name)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+def write_cache_manifest(export_dir, map_name, key, outputs):
+    manifest_path = cache_manifest_path(export_dir, map_name)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+
+    with open(manifest_path, 'w') as f:
+        json.dump({'key': key, 'outputs': outputs}, f, indent=2)
+
+def box_model_template(model_name, occupied, metadata, height=1.5, pose='0 0 0 0 0 0', headless=False):
+    # One primitive box per merged rectangle, centered on it and standing on the ground
+    resolution = metadata['resolution']
+    rectangles = list(zip(*(side.tolist() for side in merge_rectangles(occupied))))
+    boxes = []
+    for index, (x0, y0, x1, y1) in enumerate(rectangles):
+        box = dict(
+            index=index,
+            x=(x0 + x1) / 2 * resolution + metadata['origin'][0],
+            y=(y0 + y1) / 2 * resolution + metadata['origin'][1],
+            z=height / 2,
+            size_x=(x1 - x0) * resolution,
+            size_y=(y1 - y0) * resolution,
+            size_z=height
+        )
+        boxes.append(XML_BOX_COLLISION_TEMPLATE.format(**box))
+        if not headless:
+            boxes.append(XML_BOX_VISUAL_TEMPLATE.format(**box))
+
+    return XML_BOX_MODEL_TEMPLATE.format(name=model_name, pose=pose, boxes=''.join(boxes)), len(rectangles)
+
+def dilate_cells(occupied, metadata, margin=0.0):
+    # Grow obstacles by the margin, padding first so they can grow past the map edge
+    radius = int(np.ceil(margin / metadata['resolution']))
+    if radius <= 0:
+        return occupied, metadata
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1))
+    dilated = cv2.dilate(np.pad(occupied, radius).astype(np.uint8), kernel).astype(bool)
+
+    origin = list(metadata['origin'])
+    origin[0] -= radius * metadata['resolution']
+    origin[1] -= radius * metadata['resolution']
+    return dilated, dict(metadata, origin=origin)
+
+def aggregate_cells(occupied, metadata, factor=1):
+    # Conservative level of detail: a block of factor x factor cells is occupied if any of its cells is
+    if factor == 1:
+        return occupied, metadata
+
+    rows = -(-occupied.shape[0] // factor) * factor
+    cols = -(-occupied.shape[1] // factor) * factor
+    padded = np.zeros((rows, cols), dtype=bool)
+    padded[:occupied.shape[0], :occupied.shape[1]] = occupied
+
+    blocks = padded.reshape(rows // factor, factor, cols // factor, factor).any(axis=(1, 3))
+    return blocks, dict(metadata, resolution=metadata['resolution'] * factor)
+
+def lod_name(name, lod=1):
+    # The full resolution level keeps the names used before levels of detail existed
+    return name if lod == 1 else f'{name}_lod{lod}'
+
+def mesh_tile_records(tile, tile_x, tile_y, metadata, height=1.5, mesher='numpy', tolerance=0.0):
+    # Meshed around the tile's own corner, so its records only depend on the cells inside it
+    origin = list(metadata['origin'])
+    origin[0] += tile_x * metadata['resolution']
+    origin[1] += tile_y * metadata['resolution']
+    return stl_records(*mesh_cells(tile, dict(metadata, origin=origin), height, mesher, tolerance))
+
+def tile_grid_offset(occupied, metadata):
+    # Cell offset of the occupied grid from the uncropped map's corner and the fraction of a cell left over,
+    # which dilated and coarser levels of detail can have
+    anchor = metadata.get('uncropped_origin', metadata['origin'][:2])
+    offset = []
+    phase = []
+    for axis in (1, 0):
+        cells = (metadata['origin'][axis] - anchor[axis]) / metadata['resolution']
+        whole = int(round(cells)) if abs(cells - round(cells)) < 1e-6 else int(np.floor(cells))
+        offset.append(whole)
+        phase.append(round(cells - whole, 6))
+    return offset, phase
+
+def tile_cache_settings(occupied, metadata, height, options):
+    # Keyed on the uncropped map, so a crop that grows or shrinks only re-meshes the tiles it touches
+    _, phase = tile_grid_offset(occupied, metadata)
+    return {
+        'version': CACHE_VERSION,
+        'uncropped_shape': list(metadata.get('uncropped_shape', occupied.shape)),
+        'resolution': float(metadata['resolution']),
+        'uncropped_origin': [float(value) for value in metadata.get('uncropped_origin', metadata['origin'][:2])],
+        'phase': phase,
+        'height': height,
+        'mesher': options['mesher'],
+        'tolerance': options['tolerance'],
+        'tile_cells': TILE_CACHE_CELLS,
+    }
+
+def load_tile_grid(tiles_dir, settings):
+    # Occupied cells and cell offset of the previous run, or None when its tiles cannot be reused
+    try:
+        with open(os.path.join(tiles_dir, 'settings.json'), 'r') as f:
+            if json.load(f) != settings:
+                return None
+        with np.load(os.path.join(tiles_dir, 'grid.npz')) as grid:
+            rows, cols = grid['shape']
+            cells = np.unpackbits(grid['packed'], count=rows * cols).reshape(rows, cols).astype(bool)
+            return cells, grid['offset'].tolist()
+    except (OSError, ValueError, KeyError):
+        return None
+
+def tile_cells(occupied, offset, tile_row, tile_col):
+    # Cells of one tile of the uncropped grid, cells outside the occupied grid are free
+    tile = np.zeros((TILE_CACHE_CELLS, TILE_CACHE_CELLS), dtype=bool)
+    y0, x0 = tile_row * TILE_CACHE_CELLS - offset[0], tile_col * TILE_CACHE_CELLS - offset[1]
+    rows = slice(max(y0, 0), min(y0 + TILE_CACHE_CELLS, occupied.shape[0]))
+    cols = slice(max(x0, 0), min(x0 + TILE_CACHE_CELLS, occupied.shape[1]))
+    if rows.start < rows.stop and cols.start < cols.stop:
+        tile[rows.start - y0:rows.stop - y0, cols.start - x0:cols.stop - x0] = occupied[rows, cols]
+    return tile
+
+def update_tile_cache(tiles_dir, occupied, metadata, height, options):
+    # Re-meshes the tiles whose cells changed since the last run, returns every tile file in assembly order
+    settings = tile_cache_settings(occupied, metadata, height, options)
+    previous = load_tile_grid(tiles_dir, settings)
+    if previous is None:
+        shutil.rmtree(tiles_dir, ignore_errors=True)
+    os.makedirs(tiles_dir, exist_ok=True)
+
+    # Forget the old grid first, an interrupted run then rebuilds every tile next time
+    settings_path = os.path.join(tiles_dir, 'settings.json')
+    if os.path.exists(settings_path):
+        os.remove(settings_path)
+
+    # Tiles sit on the uncropped grid: tile = (crop offset + cell) // TILE_CACHE_CELLS
+    offset, phase = tile_grid_offset(occupied, metadata)
+    first = [offset[axis] // TILE_CACHE_CELLS for axis in (0, 1)]
+    last = [(offset[axis] + max(occupied.shape[axis], 1) - 1) // TILE_CACHE_CELLS for axis in (0, 1)]
+
+    tile_files = []
+    changed = []
+    tile_total = 0
+    for tile_row in range(first[0], last[0] + 1):
+        for tile_col in range(first[1], last[1] + 1):
+            tile_total += 1
+            tile = tile_cells(occupied, offset, tile_row, tile_col)
+            tile_file = os.path.join(tiles_dir, f'{tile_row}_{tile_col}.npy')
+
+            if not tile.any():
+                continue
+
+            tile_files.append(tile_file)
+            if previous is None or not os.path.exists(tile_file) or \
+                    not np.array_equal(tile_cells(*previous, tile_row, tile_col), tile):
+                changed.append((tile_file, tile, tile_col * TILE_CACHE_CELLS, tile_row * TILE_CACHE_CELLS))
+
+    # Tiles that emptied or fell outside the grid are not assembled any more
+    for name in os.listdir(tiles_dir):
+        path = os.path.join(tiles_dir, name)
+        if name.endswith('.npy') and path not in tile_files:
+            os.remove(path)
+
+    # Every tile is meshed from the uncropped corner, so its records do not depend on where the crop starts
+    grid_origin = list(metadata['origin'])
+    for axis, cells in ((0, phase[1]), (1, phase[0])):
+        grid_origin[axis] = metadata.get('uncropped_origin', metadata['origin'][:2])[axis] + \
+            cells * metadata['resolution']
+    grid_metadata = dict(metadata, origin=grid_origin)
+
+    jobs = options['mesh_jobs'] if options['mesh_jobs'] > 0 else os.cpu_count() or 1
+    args = ([tile for _, tile, _, _ in changed], [tile_x for _, _, tile_x, _ in changed],
+            [tile_y for _, _, _, tile_y in changed], repeat(grid_metadata), repeat(height),
+            repeat(options['mesher']), repeat(options['tolerance']))
+
+    if jobs == 1 or len(changed) <= 1:
+        tile_records = map(mesh_tile_records, *args)
+        for (tile_file, _, _, _), records in zip(changed, tile_records):
+            np.save(tile_file, records)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for (tile_file, _, _, _), records in zip(changed, executor.map(mesh_tile_records, *args)):
+                np.save(tile_file, records)
+
+    np.savez(os.path.join(tiles_dir, 'grid.npz'), packed=np.packbits(occupied, axis=None),
+             shape=np.array(occupied.shape), offset=np.array(offset))
+    with open(settings_path, 'w') as f:
+        json.dump(settings, f, indent=2)
+
+    return tile_files, len(changed), tile_total
+
+def export_mesh(stl_dir, occupied, metadata, height, options, profiler, tiles_dir=None):
+    print(f'Exporting to file: {stl_dir}')
+    
+    if options['validate']:
+        # Full trimesh pass: normal fixing, duplicate face removal and a watertightness check
+        with profiler.stage('mesh'):
+            chunks = iter_mesh_chunks(
+                occupied, metadata, height, options['mesher'], options['tolerance'], options['mesh_jobs']
+            )
+            vertices, faces = concatenate_chunks(chunks)
+        triangle_count = len(faces)
+        mesh = mesh_from_arrays(vertices, faces, profiler)
+        print(f'Validated mesh {stl_dir}: watertight={mesh.is_watertight}, volume={mesh.is_volume}')
+        profiler.count(vertices=len(mesh.vertices), faces=len(mesh.faces))
+
+        with profiler.stage('export'):
+            with open(stl_dir, 'wb') as f:
+                mesh.export(f, "stl")
+    elif options['incremental'] and tiles_dir:
+        # Full and incremental builds both assemble the STL from the cached tiles, so they match
+        with profiler.stage('mesh_export'):
+            tile_files, remeshed, tile_total = update_tile_cache(tiles_dir, occupied, metadata, height, options)
+            tile_records = (np.load(tile_file) for tile_file in tile_files)
+            triangle_count = write_binary_stl(stl_dir, notify_chunks(tile_records, profiler, 'mesh_export'))
+        print(f'Re-meshed {remeshed} of {tile_total} tiles for {stl_dir}')
+        profiler.count(vertices=3 * triangle_count, faces=triangle_count, remeshed_tiles=remeshed)
+    else:
+        # Workers encode the STL records themselves, the parent only writes them out
+        with profiler.stage('mesh_export'):
+            record_chunks = iter_mesh_chunks(
+                occupied, metadata, height, options['mesher'], options['tolerance'], options['mesh_jobs'], records=True
+            )
+            triangle_count = write_binary_stl(stl_dir, notify_chunks(record_chunks, profiler, 'mesh_export'))
+        # STL stores every triangle with its own three vertices
+        profiler.count(vertices=3 * triangle_count, faces=triangle_count)
+
+    return triangle_count
+
+def export_model(model_name, export_dir, occupied, metadata, height, options, pose='0 0 0 0 0 0', profiler=None,
+                 lod=1, write_sdf=True):
+    profiler = profiler or StageProfiler()
+
+    model_dir = export_dir + f'{model_name}'
+    meshes_dir = model_dir + '/meshes/'
+    tiles_dir = model_dir + f'/{TILE_CACHE_DIR}/'
+    
+    if not os.path.exists(model_dir):
+        os.makedirs(model_dir)
+
+    # Every level of detail shares the model directory, only the level the main world uses owns the SDF
+    mesh_name = lod_name(model_name, lod)
+    stl_dir = meshes_dir + f'{mesh_name}.stl'
+    sdf_dir = model_dir + f'/{model_name}.sdf'
+    config_dir = model_dir + '/model.config'
+    written_files = [sdf_dir, config_dir] if write_sdf else [config_dir]
+
+    if options['geometry'] == 'boxes':
+        # Primitive boxes collide far cheaper than triangle meshes, no STL is needed
+        with profiler.stage('boxes'):
+            model_template, box_count = box_model_template(
+                model_name, occupied, metadata, height, pose, options['headless']
+            )
+        triangle_count = 12 * box_count
+        profiler.count(boxes=box_count)
+        print(f'Exporting {box_count} boxes to file: {sdf_dir}')
+    else:
+        if not os.path.exists(meshes_dir):
+            os.makedirs(meshes_dir)
+
+        collision_mesh = mesh_name
+        if options['collision_mesh']:
+            # Physics gets its own simplified outline mesh, optionally grown by a safety margin
+            collision_mesh = f'{mesh_name}_collision'
+            collision_occupied, collision_metadata = dilate_cells(occupied, metadata, options['collision_margin'])
+            collision_options = dict(options, mesher=COLLISION_MESHER, tolerance=options['collision_tolerance'])
+            collision_dir = meshes_dir + f'{collision_mesh}.stl'
+            triangle_count = export_mesh(
+                collision_dir, collision_occupied, collision_metadata, height, collision_options, profiler,
+                tiles_dir + collision_mesh
+            )
+            written_files.append(collision_dir)
+            print(f'Collision mesh for {mesh_name}: {triangle_count} triangles')
+
+        # Headless runs never render, so the visual mesh is only needed when it doubles as the collision mesh
+        if not options['headless'] or collision_mesh == mesh_name:
+            triangle_count = export_mesh(stl_dir, occupied, metadata, height, options, profiler, tiles_dir + mesh_name)
+            written_files.append(stl_dir)
+
+        visual = '' if options['headless'] else XML_VISUAL_TEMPLATE.format(name=model_name, visual_mesh=mesh_name)
+        model_template = XML_MODEL_TEMPLATE.format(
+            name=model_name, pose=pose, collision_mesh=collision_mesh, visual=visual
+        )
+
+    sdf_data = XML_SDF_TEMPLATE.format(model_template=model_template)
+    config_data = XML_MODEL_CONFIG_TEMPLATE.format(name=model_name)
+
+    if write_sdf:
+        with open(sdf_dir, 'w') as f:
+            f.write(sdf_data)
+
+    with open(config_dir, 'w') as f:
+        f.write(config_data)
+
+    profiler.count(bytes_written=sum(os.path.getsize(path) for path in written_files))
+
+    return model_template, triangle_count, written_files
+
+def export_models(map_name, export_dir, occupied, map_info, height, options, profiler, lod=1, write_sdf=True):
+    if not options['tile_size']:
+        model_template, triangle_count, outputs = export_model(
+            map_name, export_dir, occupied, map_info, height, options, profiler=profiler, lod=lod, write_sdf=write_sdf
+        )
+        return [model_template], triangle_count, outputs
+
+    # One model per non-empty tile, meshed around its own corner and placed with a pose
+    resolution = map_info['resolution']
+    tile_cells = max(1, int(round(options['tile_size'] / resolution)))
+    tile_info = {'resolution': resolution, 'origin': [0.0, 0.0, 0.0]}
+    model_templates = []
+    outputs = []
+    triangle_count = 0
+    tile_total = 0
+
+    for tile_y in range(0, occupied.shape[0], tile_cells):
+        for tile_x in range(0, occupied.shape[1], tile_cells):
+            tile_total += 1
+            tile = occupied[tile_y:tile_y + tile_cells, tile_x:tile_x + tile_cells]
+            if not tile.any():
+                continue
+
+            tile_name = f'{map_name}_tile_{tile_y // tile_cells}_{tile_x // tile_cells}'
+            pose_x = map_info['origin'][0] + tile_x * resolution
+            pose_y = map_info['origin'][1] + tile_y * resolution
+            model_template, tile_triangles, tile_files = export_model(
+                tile_name, export_dir, tile, tile_info, height, options,
+                pose=f'{pose_x} {pose_y} 0 0 0 0', profiler=profiler, lod=lod, write_sdf=write_sdf
+            )
+            model_templates.append(model_template)
+            outputs.extend(tile_files)
+            triangle_count += tile_triangles
+
+    print(f'Exported {len(model_templates)} non-empty tiles out of {tile_total} for map: {lod_name(map_name, lod)}')
+    return model_templates, triangle_count, outputs
+
+def process_map(map_info, export_dir, world_dir, height=1.5, progress=None, **options):
+    options = dict(DEFAULT_OPTIONS, **options)
+
     # Check if the required keys exist in the map info dictionary
     if 'map_name' not in map_info or 'image' not in map_info:
         print(f"Error: Map info missing required keys 'map_name' or 'image'")
@@ -205,80 +1253,278 @@ def process_map(map_info, export_dir, world_dir, height=1.5):
     if not os.path.exists(image_path):
         print(f"Error: Image file {image_path} not found")
         return False
+
+    if not export_dir.endswith('/'):
+        export_dir = export_dir + '/'
+
+    if not world_dir.endswith('/'):
+        world_dir = world_dir + '/'
+
+    levels = options['lod_levels'] or [1]
+    if any(lod < 1 for lod in levels) or options['world_lod'] not in levels:
+        print(f"Error: Invalid levels of detail {levels} with world level {options['world_lod']} for map {map_name}")
+        return False
+
+    # progress is called with the map name and each stage as the conversion moves on
+    profiler = StageProfiler(partial(progress, map_name) if progress else None)
+    if options['profile']:
+        # Serial batches and reused pool workers would otherwise report the peak of an earlier map
+        profiler.reset_peak_rss()
+
+    with profiler.stage('cache_check'):
+        key = cache_key(map_info, export_dir, world_dir, height, options)
+        # A profile only means something for a full conversion, so profiled runs never skip
+        cached = not options['force'] and not options['profile'] and is_cached(export_dir, map_name, key)
+
+    if cached:
+        print(f'Map {map_name} is unchanged, skipping (use --force to regenerate)')
+        return True
+
+    # Forget the previous outputs before overwriting any, a failed or cancelled run then never counts as cached
+    remove_cache_manifest(export_dir, map_name)
         
     print(f'Loading map file: {image_path}')
     
     try:
-        map_array = cv2.imread(image_path)
-        map_array = cv2.flip(map_array, 0)
-        map_array = cv2.cvtColor(map_array, cv2.COLOR_BGR2GRAY)
-    except cv2.error as err:
+        with profiler.stage('load'):
+            map_array = load_map_image(image_path)
+    except (cv2.error, ValueError) as err:
         print(err, "Conversion failed: Invalid image input, please check your file path")    
         return False
 
-    # Set all -1 (unknown) values to 255 (white/unoccupied)
-    # map_array[map_array < 0] = 255
-    map_array[map_array < 253] = 0
-    map_array[map_array >= 253] = 255
-    print('Processing...')
-    mesh = create_mesh_from_map(map_array, map_info, height)
+    if map_array is None:
+        print("Conversion failed: Invalid image input, please check your file path")
+        return False
 
-    if not export_dir.endswith('/'):
-        export_dir = export_dir + '/'
+    print('Processing...')
+    with profiler.stage('threshold'):
+        # Walls become 0 and free space 255, with unknown pixels resolved by the policy
+        uncropped_shape = map_array.shape
+        map_array, map_info = wall_map(map_array, map_info, options['unknown'], options['crop'])
+        occupied = occupied_cells(map_array, map_info)
 
-    if not world_dir.endswith('/'):
-        world_dir = world_dir + '/'
-    
-    model_dir = export_dir + f'{map_name}'
-    meshes_dir = model_dir + '/meshes/'
-    
-    if not os.path.exists(meshes_dir):
-        os.makedirs(meshes_dir)
+    if map_array.shape != uncropped_shape:
+        print(f'Cropped {map_name} from {uncropped_shape[1]}x{uncropped_shape[0]} '
+              f'to {map_array.shape[1]}x{map_array.shape[0]} pixels')
+    profiler.count(pixels=uncropped_shape[0] * uncropped_shape[1], occupied_cells=np.count_nonzero(occupied))
 
     if not os.path.exists(world_dir):
         os.makedirs(world_dir)
 
-    stl_dir = meshes_dir + f'{map_name}.stl'
-    sdf_dir = model_dir + f'/{map_name}.sdf'
-    config_dir = model_dir + '/model.config'
+    outputs = []
+    lod_report = {}
 
-    model_template = XML_MODEL_TEMPLATE.format(name=map_name)
-    sdf_data = XML_SDF_TEMPLATE.format(model_template=model_template)
-    config_data = XML_MODEL_CONFIG_TEMPLATE.format(name=map_name)
-    print(f'Exporting to file: {stl_dir}')
-    
-    with open(stl_dir, 'wb') as f:
-        mesh.export(f, "stl")
+    for lod in levels:
+        # Each level is meshed from the full resolution cells, never from a coarser level
+        lod_occupied, lod_info = aggregate_cells(occupied, map_info, lod)
+        model_templates, triangle_count, lod_outputs = export_models(
+            map_name, export_dir, lod_occupied, lod_info, height, options, profiler,
+            lod=lod, write_sdf=lod == options['world_lod']
+        )
+        outputs.extend(lod_outputs)
+        report_triangles(lod_name(map_name, lod), lod_occupied, triangle_count)
 
-    with open(sdf_dir, 'w') as f:
-        f.write(sdf_data)
+        # Create world files, the plain one holds the level picked by --world-lod
+        with profiler.stage('world'):
+            world_data = XML_WORLD_TEMPLATE.format(model_template=''.join(model_templates))
+            lod_world_files = [world_dir + f'{map_name}_lod{lod}.sdf'] if options['lod_levels'] else []
+            if lod == options['world_lod']:
+                lod_world_files.append(world_dir + f'{map_name}.sdf')
 
-    with open(config_dir, 'w') as f:
-        f.write(config_data)
+            for world_file in lod_world_files:
+                with open(world_file, 'w') as f:
+                    f.write(world_data)
+                profiler.count(bytes_written=os.path.getsize(world_file))
+            outputs.extend(lod_world_files)
 
-    # Create world file
-    world_data = XML_WORLD_TEMPLATE.format(model_template=model_template)
+        lod_report[str(lod)] = {
+            'resolution': lod_info['resolution'],
+            'occupied_cells': int(np.count_nonzero(lod_occupied)),
+            'triangles': triangle_count,
+            'world': lod_world_files[0] if lod_world_files else None,
+        }
 
-    world_file = world_dir + f'{map_name}.sdf'
-    with open(world_file, 'w') as f:
-        f.write(world_data)
+    if options['lod_levels']:
+        # Triangle counts per level, to pick the fast world for CI runs and the detailed one for demos
+        lod_file = world_dir + f'{map_name}_lod.json'
+        with open(lod_file, 'w') as f:
+            json.dump({'map_name': map_name, 'world_lod': options['world_lod'], 'levels': lod_report}, f, indent=2)
+        outputs.append(lod_file)
+
+    # Levels of detail share the model.config of each model directory
+    write_cache_manifest(export_dir, map_name, key, list(dict.fromkeys(outputs)))
+
+    if options['profile']:
+        write_profile_report(export_dir, map_name, profiler)
     
     print(f'Successfully processed map: {map_name}')
     return True
 
-def process_maps(map_info_list, export_dir, world_dir, height=1.5):
+def timed_process_map(map_info, export_dir, world_dir, height=1.5, progress=None, **options):
+    start_time = time.perf_counter()
+    try:
+        success = process_map(map_info, export_dir, world_dir, height, progress, **options)
+    except ConversionCancelled:
+        raise
+    except Exception as e:
+        print(f"Error processing map {map_info.get('map_name')}: {str(e)}")
+        success = False
+
+    return success, time.perf_counter() - start_time
+
+def process_maps(map_info_list, export_dir, world_dir, height=1.5, jobs=1, progress=None, **options):
     success_count = 0
     fail_count = 0
+    timings = []
+
+    error = triangulation_error(options)
+    if error is not None:
+        print(f'Error: {error}')
+        return 0, len(map_info_list)
+
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
     
-    for map_info in map_info_list:
-        if process_map(map_info, export_dir, world_dir, height):
+    if jobs > 1 and len(map_info_list) > 1:
+        # Maps are independent, so each one is converted in its own worker process
+        # Callbacks cannot cross into the workers, progress then only hears about finished maps
+        with ProcessPoolExecutor(max_workers=min(jobs, len(map_info_list))) as executor:
+            futures = {
+                executor.submit(timed_process_map, map_info, export_dir, world_dir, height, **options): map_info
+                for map_info in map_info_list
+            }
+            results = [(futures[future], future.result()) for future in as_completed(futures)]
+    else:
+        results = (
+            (map_info, timed_process_map(map_info, export_dir, world_dir, height, progress, **options))
+            for map_info in map_info_list
+        )
+
+    for map_info, (success, elapsed) in results:
+        timings.append((map_info.get('map_name'), success, elapsed))
+        if progress:
+            progress(map_info.get('map_name'), PROGRESS_DONE)
+        if success:
             success_count += 1
         else:
             fail_count += 1
+
+    for map_name, success, elapsed in timings:
+        print(f"  {map_name}: {'ok' if success else 'failed'} in {elapsed:.2f} s")
+
+    if options.get('profile'):
+        print_profile_summary(export_dir, [map_name for map_name, success, _ in timings if success])
     
     print(f'Conversion completed. Success: {success_count}, Failed: {fail_count}')
     return success_count, fail_count
 
+def load_map_info(yaml_file):
+    try:
+        with open(yaml_file, 'r') as stream:
+            map_info = yaml.safe_load(stream)
+            
+            # Add map_name based on the YAML filename
+            map_name = os.path.splitext(os.path.basename(yaml_file))[0]
+            map_info['map_name'] = map_name
+            
+            # Make image path absolute if it's relative
+            if not os.path.isabs(map_info['image']):
+                yaml_dir = os.path.dirname(os.path.abspath(yaml_file))
+                map_info['image'] = os.path.join(yaml_dir, map_info['image'])
+    except Exception as e:
+        print(f"Error loading YAML file {yaml_file}: {str(e)}")
+        return None
+
+    return map_info
+
+def find_yaml_files(map_dir):
+    return sorted(
+        os.path.join(map_dir, file) for file in os.listdir(map_dir)
+        if file.lower().endswith('.yaml') or file.lower().endswith('.yml')
+    )
+
+class MapDirWatcher:
+    # Names of the files written into map_dir, from inotify when inotify_simple is installed, else by polling
+    def __init__(self, map_dir, poll_interval=1.0):
+        self.map_dir = map_dir
+        self.poll_interval = poll_interval
+        self.inotify = None
+
+        try:
+            from inotify_simple import INotify, flags
+        except ImportError:
+            print(f'inotify_simple is not installed, polling {map_dir} every {poll_interval} s')
+            self.snapshot = self.scan()
+            return
+
+        self.inotify = INotify()
+        # Closed after writing or renamed into place, so half-opened files are not reported
+        self.inotify.add_watch(map_dir, flags.CLOSE_WRITE | flags.MOVED_TO)
+
+    def scan(self):
+        snapshot = {}
+        for entry in os.scandir(self.map_dir):
+            if entry.is_file():
+                stat = entry.stat()
+                snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def changes(self, timeout=None):
+        # Waits up to timeout seconds (forever when None) and returns the names written meanwhile
+        if self.inotify is not None:
+            events = self.inotify.read(timeout=None if timeout is None else int(timeout * 1000))
+            return {event.name for event in events if event.name}
+
+        time.sleep(self.poll_interval if timeout is None else min(timeout, self.poll_interval))
+        snapshot = self.scan()
+        changed = {name for name, stat in snapshot.items() if self.snapshot.get(name) != stat}
+        self.snapshot = snapshot
+        return changed
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+def affected_maps(map_dir, changed_names):
+    # Maps whose YAML or image is among the written files
+    map_info_list = []
+    for yaml_file in find_yaml_files(map_dir):
+        map_info = load_map_info(yaml_file)
+        if map_info is None:
+            continue
+
+        image = os.path.abspath(map_info['image'])
+        image_changed = os.path.dirname(image) == os.path.abspath(map_dir) and os.path.basename(image) in changed_names
+        if os.path.basename(yaml_file) in changed_names or image_changed:
+            map_info_list.append(map_info)
+
+    return map_info_list
+
+def watch_maps(map_dir, export_dir, world_dir, height=1.5, jobs=1, debounce=1.0, **options):
+    watcher = MapDirWatcher(map_dir)
+    changed = set()
+    print(f'Watching {map_dir} for saved maps, press Ctrl+C to stop')
+
+    try:
+        while True:
+            # Map savers write the image and the YAML one after the other, wait until writes settle
+            names = watcher.changes(debounce if changed else None)
+            if names:
+                changed |= names
+                continue
+            if not changed:
+                continue
+
+            map_info_list = affected_maps(map_dir, changed)
+            changed = set()
+            if map_info_list:
+                print(f"Regenerating: {', '.join(map_info['map_name'] for map_info in map_info_list)}")
+                process_maps(map_info_list, export_dir, world_dir, height, jobs, **options)
+    except KeyboardInterrupt:
+        print('Stopped watching')
+    finally:
+        watcher.close()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     
@@ -301,8 +1547,118 @@ if __name__ == "__main__":
         '--height', type=float, default=1.5,
         help='Height of the 3D map mesh'
     )
+
+    parser.add_argument(
+        '--mesher', type=str, choices=MESHERS, default=DEFAULT_OPTIONS['mesher'],
+        help='Mesh engine: per-pixel python loop or vectorized numpy (identical output), '
+             'greedy merging of occupied cells into rectangular boxes, or extruded obstacle contours'
+    )
+
+    parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_OPTIONS['tolerance'],
+        help='Contour simplification tolerance in meters (contour mesher only)'
+    )
+
+    parser.add_argument(
+        '--validate', action='store_true',
+        help='Build the mesh with trimesh to fix normals and drop duplicate faces before export, '
+             'instead of streaming triangles straight to the STL file'
+    )
+
+    parser.add_argument(
+        '--tile-size', type=float, default=DEFAULT_OPTIONS['tile_size'],
+        help='Split each map into square tiles of this size in meters, exported as separate models'
+    )
+
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of maps converted in parallel worker processes (0 uses every core)'
+    )
+
+    parser.add_argument(
+        '--mesh-jobs', type=int, default=DEFAULT_OPTIONS['mesh_jobs'],
+        help='Number of worker processes meshing and encoding row bands of a single map, numpy and greedy meshers '
+             '(0 uses every core)'
+    )
+
+    parser.add_argument(
+        '--unknown', type=str, choices=UNKNOWN_POLICIES, default=DEFAULT_OPTIONS['unknown'],
+        help='How unknown pixels are meshed: as walls, as free space, or as walls only where they border free space'
+    )
+
+    parser.add_argument(
+        '--no-crop', dest='crop', action='store_false',
+        help='Keep the whole image instead of cropping it to the bounding box of known pixels'
+    )
+
+    parser.add_argument(
+        '--geometry', type=str, choices=GEOMETRIES, default=DEFAULT_OPTIONS['geometry'],
+        help='Model geometry: an STL mesh built by --mesher, or primitive boxes for merged occupied rectangles'
+    )
+
+    parser.add_argument(
+        '--collision-mesh', action='store_true',
+        help='Export a separate simplified contour mesh for collisions, the --mesher mesh is then only visual'
+    )
+
+    parser.add_argument(
+        '--collision-tolerance', type=float, default=DEFAULT_OPTIONS['collision_tolerance'],
+        help='Simplification tolerance in meters of the collision mesh, obstacles are grown by it first '
+             'so that the simplified mesh still covers every occupied cell'
+    )
+
+    parser.add_argument(
+        '--collision-margin', type=float, default=DEFAULT_OPTIONS['collision_margin'],
+        help='Distance in meters obstacles are grown by in the collision mesh'
+    )
+
+    parser.add_argument(
+        '--headless', action='store_true',
+        help='Leave visuals out of the models and skip the visual mesh when a collision mesh is exported'
+    )
+
+    parser.add_argument(
+        '--lod-levels', type=int, nargs='+', default=DEFAULT_OPTIONS['lod_levels'],
+        help='Cell aggregation factors to export levels of detail for, e.g. 1 2 4, each with its own <map>_lod<k>.sdf world'
+    )
+
+    parser.add_argument(
+        '--world-lod', type=int, default=DEFAULT_OPTIONS['world_lod'],
+        help='Level of detail used by the plain <map>.sdf world and the model SDF, e.g. 1 for demos or 4 for fast CI runs'
+    )
+
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='Mesh in fixed tiles cached inside the model directory and re-mesh only the tiles an edit changed'
+    )
+
+    parser.add_argument(
+        '--watch', action='store_true',
+        help='Keep running and regenerate each map when it is saved into --map_dir (inotify with inotify_simple, else polling)'
+    )
+
+    parser.add_argument(
+        '--debounce', type=float, default=1.0,
+        help='Seconds without further writes before a saved map is regenerated in --watch mode'
+    )
+
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Record wall time, peak RSS and element counts per stage into a JSON report for each map, '
+             'regenerating every map like --force'
+    )
+
+    parser.add_argument(
+        '--force', action='store_true',
+        help='Regenerate every map even if its image, YAML and options are unchanged since the last run'
+    )
     
     args = parser.parse_args()
+
+    error = triangulation_error(vars(args))
+    if error is not None:
+        print(f"Error: {error}")
+        sys.exit(1)
     
     # Check if map_dir exists
     if not os.path.isdir(args.map_dir):
@@ -310,12 +1666,9 @@ if __name__ == "__main__":
         sys.exit(1)
     
     # Find all YAML files in the map_dir
-    yaml_files = []
-    for file in os.listdir(args.map_dir):
-        if file.lower().endswith('.yaml') or file.lower().endswith('.yml'):
-            yaml_files.append(os.path.join(args.map_dir, file))
+    yaml_files = find_yaml_files(args.map_dir)
     
-    if not yaml_files:
+    if not yaml_files and not args.watch:
         print(f"Error: No YAML files found in {args.map_dir}")
         sys.exit(1)
     
@@ -324,27 +1677,40 @@ if __name__ == "__main__":
     # Process the list of YAML files and create map_info_list
     map_info_list = []
     for yaml_file in yaml_files:
-        try:
-            with open(yaml_file, 'r') as stream:
-                map_info = yaml.safe_load(stream)
-                
-                # Add map_name based on the YAML filename
-                map_name = os.path.splitext(os.path.basename(yaml_file))[0]
-                map_info['map_name'] = map_name
-                
-                # Make image path absolute if it's relative
-                if not os.path.isabs(map_info['image']):
-                    yaml_dir = os.path.dirname(os.path.abspath(yaml_file))
-                    map_info['image'] = os.path.join(yaml_dir, map_info['image'])
-                
-                map_info_list.append(map_info)
-                print(f"Added map: {map_name}")
-        except Exception as e:
-            print(f"Error loading YAML file {yaml_file}: {str(e)}")
+        map_info = load_map_info(yaml_file)
+        if map_info is not None:
+            map_info_list.append(map_info)
+            print(f"Added map: {map_info['map_name']}")
     
-    if not map_info_list:
+    if not map_info_list and not args.watch:
         print("No valid map files found. Exiting.")
         sys.exit(1)
     
+    options = dict(
+        mesher=args.mesher,
+        tolerance=args.tolerance,
+        validate=args.validate,
+        tile_size=args.tile_size,
+        mesh_jobs=args.mesh_jobs,
+        force=args.force,
+        unknown=args.unknown,
+        crop=args.crop,
+        profile=args.profile,
+        geometry=args.geometry,
+        collision_mesh=args.collision_mesh,
+        collision_tolerance=args.collision_tolerance,
+        collision_margin=args.collision_margin,
+        headless=args.headless,
+        lod_levels=args.lod_levels,
+        world_lod=args.world_lod,
+        incremental=args.incremental
+    )
+
     # Process all maps
-    process_maps(map_info_list, args.model_dir, args.world_dir, args.height)
+    if map_info_list:
+        process_maps(map_info_list, args.model_dir, args.world_dir, args.height, jobs=args.jobs, **options)
+
+    if args.watch:
+        # Later saves only regenerate the map that was written, --force applied to the first pass only
+        options['force'] = False
+        watch_maps(args.map_dir, args.model_dir, args.world_dir, args.height, args.jobs, args.debounce, **options)
@@ -0,0 +1,337 @@
+import argparse
+import gc
+import io
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+import cv2
+import numpy as np
+import yaml
+
+from map2gazebo import (
+    MESHERS, STL_HEADER_BYTES, STL_TRIANGLE, create_mesh_from_map, load_map_image, peak_rss_mb, process_map,
+    reset_peak_rss, wall_map
+)
+
+
+SHIPPED_MAPS = ('turtlebot3_world', 'playground', 'map')
+
+DEFAULT_MAP_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', '..', 'linorobot2_navigation', 'maps'
+)
+
+TARGETS = ('create_mesh_from_map', 'process_map')
+
+# Metrics compared against a baseline, and whether a higher value is better. Memory is gated on the growth
+# above the worker's RSS after imports, its peak RSS is mostly the cv2, trimesh and scipy modules
+REGRESSION_METRICS = {
+    'cells_per_second': True,
+    'rss_growth_mb': False,
+}
+
+def synthetic_map(size, density, seed=0):
+    # Free space crossed by random axis-aligned walls until the requested share of pixels is occupied
+    rng = np.random.default_rng(seed)
+    image = np.full((size, size), 254, dtype=np.uint8)
+    target = int(density * size * size)
+    occupied = 0
+
+    while occupied < target:
+        for _ in range(64):
+            thickness = int(rng.integers(1, 4))
+            length = int(rng.integers(size // 16 + 1, size // 4 + 2))
+            x, y = (int(value) for value in rng.integers(0, size, 2))
+            if rng.random() < 0.5:
+                image[y:y + thickness, x:x + length] = 0
+            else:
+                image[y:y + length, x:x + thickness] = 0
+        occupied = int(np.count_nonzero(image == 0))
+
+    return image
+
+def write_synthetic_map(map_dir, size, density, seed=0):
+    map_name = f'synthetic_{size}'
+    image_path = os.path.join(map_dir, f'{map_name}.pgm')
+    cv2.imwrite(image_path, synthetic_map(size, density, seed))
+
+    map_info = {
+        'image': image_path,
+        'resolution': 0.05,
+        'origin': [-size * 0.025, -size * 0.025, 0.0],
+        'negate': 0,
+        'occupied_thresh': 0.65,
+        'free_thresh': 0.196,
+        'map_name': map_name,
+    }
+    return map_info
+
+def load_shipped_map(map_dir, map_name):
+    yaml_file = os.path.join(map_dir, f'{map_name}.yaml')
+    with open(yaml_file, 'r') as stream:
+        map_info = yaml.safe_load(stream)
+
+    map_info['map_name'] = map_name
+    if not os.path.isabs(map_info['image']):
+        map_info['image'] = os.path.join(os.path.dirname(os.path.abspath(yaml_file)), map_info['image'])
+    return map_info
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, file))
+        for root, _, files in os.walk(path)
+        for file in files
+    )
+
+def run_once(map_info, target, mesher, height, tolerance, output_dir):
+    if target == 'create_mesh_from_map':
+        map_array = load_map_image(map_info['image'])
+        cells = map_array.size
+        map_array, metadata = wall_map(map_array, map_info)
+
+        start_time = time.perf_counter()
+        mesh = create_mesh_from_map(map_array, metadata, height, mesher, tolerance)
+        seconds = time.perf_counter() - start_time
+
+        triangles = len(mesh.faces)
+        output_bytes = STL_HEADER_BYTES + STL_TRIANGLE.itemsize * triangles
+    else:
+        start_time = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            success = process_map(
+                map_info, output_dir, output_dir, height, mesher=mesher, tolerance=tolerance, force=True, profile=True
+            )
+        seconds = time.perf_counter() - start_time
+        if not success:
+            raise RuntimeError(f"process_map failed for {map_info['map_name']}")
+
+        with open(os.path.join(output_dir, '.map2gazebo_profile', f"{map_info['map_name']}.json"), 'r') as f:
+            counts = json.load(f)['counts']
+        triangles = counts['faces']
+        cells = counts['pixels']
+        output_bytes = directory_size(output_dir)
+
+    return seconds, cells, triangles, output_bytes
+
+def run_case(map_info, target, mesher, height, tolerance, output_dir, repeat=1, warmup=0):
+    # Runs in a fresh worker process so ru_maxrss only covers this case
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # The imports can peak above the RSS they leave behind, resetting the high-water mark here keeps
+    # that transient out of the growth
+    resettable = reset_peak_rss()
+    baseline_hwm = peak_rss_mb()
+
+    for _ in range(warmup):
+        run_once(map_info, target, mesher, height, tolerance, output_dir)
+        # trimesh keeps reference cycles, collected here so peak RSS stays the peak of a single run
+        gc.collect()
+
+    runs = []
+    for _ in range(max(repeat, 1)):
+        seconds, cells, triangles, output_bytes = run_once(map_info, target, mesher, height, tolerance, output_dir)
+        runs.append(seconds)
+        gc.collect()
+
+    # The best run is the least disturbed by the rest of the machine, the median shows the spread
+    seconds = min(runs)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'seconds': seconds,
+        'median_seconds': float(np.median(runs)),
+        'runs': len(runs),
+        'cells': cells,
+        'cells_per_second': cells / seconds if seconds > 0 else 0.0,
+        'triangles': triangles,
+        'peak_rss_mb': peak_rss / 1024.0,
+        'rss_growth_mb': peak_rss_mb() - baseline_hwm if resettable else (peak_rss - baseline_rss) / 1024.0,
+        'output_bytes': output_bytes,
+    }
+
+def benchmark(map_infos, targets, meshers, height=1.5, tolerance=0.0, max_loop_pixels=512 ** 2,
+              max_trimesh_pixels=2048 ** 2, repeat=1, warmup=0):
+    results = {}
+    context = multiprocessing.get_context('spawn')
+
+    for map_info in map_infos:
+        image = cv2.imread(map_info['image'], cv2.IMREAD_GRAYSCALE)
+        pixels = image.shape[0] * image.shape[1]
+
+        for target in targets:
+            for mesher in meshers:
+                # The per-pixel loop and whole-mesh trimesh passes would take hours on the biggest maps
+                if mesher == 'loop' and pixels > max_loop_pixels:
+                    continue
+                if target == 'create_mesh_from_map' and pixels > max_trimesh_pixels:
+                    continue
+
+                case = f"{map_info['map_name']}/{target}/{mesher}"
+                output_dir = tempfile.mkdtemp(prefix='map2gazebo_benchmark_')
+                try:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        result = executor.submit(
+                            run_case, map_info, target, mesher, height, tolerance, output_dir, repeat, warmup
+                        ).result()
+                except Exception as e:
+                    print(f'{case}: failed ({str(e)})')
+                    continue
+                finally:
+                    shutil.rmtree(output_dir, ignore_errors=True)
+
+                results[case] = result
+                print(f"{case:<48} {result['seconds']:>9.3f} s {result['cells_per_second']:>14.0f} cells/s "
+                      f"{result['triangles']:>11} tris {result['peak_rss_mb']:>9.1f} MB "
+                      f"{result['rss_growth_mb']:>+9.1f} MB "
+                      f"{result['output_bytes']:>13} bytes")
+
+    return results
+
+def find_regressions(results, baseline, max_regression, min_seconds=0.0, min_rss_mb=0.0):
+    regressions = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+
+        # Throughput of cases this short is mostly timer and scheduler noise
+        timed = min(result.get('seconds', 0.0), baseline[case].get('seconds', 0.0)) >= min_seconds
+
+        for metric, higher_is_better in REGRESSION_METRICS.items():
+            if metric == 'cells_per_second' and not timed:
+                continue
+
+            previous = baseline[case].get(metric)
+            current = result.get(metric)
+            if not previous or current is None:
+                continue
+
+            # Growth of a few megabytes is allocator noise, however large it is relative to a tiny case
+            if metric == 'rss_growth_mb' and abs(current - previous) < min_rss_mb:
+                continue
+
+            change = (current - previous) / previous
+            if (higher_is_better and change < -max_regression) or (not higher_is_better and change > max_regression):
+                regressions.append(f'{case}: {metric} {previous:.1f} -> {current:.1f} ({change:+.1%})')
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the map2gazebo mesh pipeline')
+
+    parser.add_argument(
+        '--map_dir', type=str, default=DEFAULT_MAP_DIR,
+        help='Directory containing the shipped turtlebot3_world, playground and map YAML files'
+    )
+
+    parser.add_argument(
+        '--sizes', type=int, nargs='*', default=[256, 512, 1024, 2048, 4096, 8192],
+        help='Edge lengths in pixels of the synthetic square maps'
+    )
+
+    parser.add_argument(
+        '--density', type=float, default=0.05,
+        help='Share of occupied pixels in the synthetic maps'
+    )
+
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Random seed of the synthetic maps'
+    )
+
+    parser.add_argument(
+        '--meshers', type=str, nargs='*', choices=MESHERS, default=list(MESHERS),
+        help='Mesher options to benchmark'
+    )
+
+    parser.add_argument(
+        '--targets', type=str, nargs='*', choices=TARGETS, default=list(TARGETS),
+        help='Entry points to benchmark'
+    )
+
+    parser.add_argument(
+        '--height', type=float, default=1.5,
+        help='Height of the 3D map mesh'
+    )
+
+    parser.add_argument(
+        '--tolerance', type=float, default=0.0,
+        help='Contour simplification tolerance in meters'
+    )
+
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Timed runs per case, the fastest one is reported and compared'
+    )
+
+    parser.add_argument(
+        '--warmup', type=int, default=1,
+        help='Untimed runs per case before the timed ones'
+    )
+
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help='Write the results to this JSON file, usable later as --baseline'
+    )
+
+    parser.add_argument(
+        '--baseline', type=str, default=None,
+        help='JSON results of an earlier run to check for regressions'
+    )
+
+    parser.add_argument(
+        '--max-regression', type=float, default=0.2,
+        help='Allowed relative drop in throughput or growth in memory use before failing'
+    )
+
+    parser.add_argument(
+        '--min-seconds', type=float, default=0.05,
+        help='Cases whose best run is shorter than this are not checked for throughput regressions'
+    )
+
+    parser.add_argument(
+        '--min-rss-mb', type=float, default=5.0,
+        help='Changes in memory growth smaller than this many MB are not regressions'
+    )
+
+    args = parser.parse_args()
+
+    map_infos = []
+    for map_name in SHIPPED_MAPS:
+        if os.path.exists(os.path.join(args.map_dir, f'{map_name}.yaml')):
+            map_infos.append(load_shipped_map(args.map_dir, map_name))
+        else:
+            print(f'Warning: shipped map {map_name} not found in {args.map_dir}')
+
+    synthetic_dir = tempfile.mkdtemp(prefix='map2gazebo_synthetic_')
+    try:
+        for size in args.sizes:
+            map_infos.append(write_synthetic_map(synthetic_dir, size, args.density, args.seed))
+
+        results = benchmark(
+            map_infos, args.targets, args.meshers, args.height, args.tolerance, repeat=args.repeat, warmup=args.warmup
+        )
+    finally:
+        shutil.rmtree(synthetic_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = find_regressions(results, baseline, args.max_regression, args.min_seconds, args.min_rss_mb)
+        if regressions:
+            print('Regressions against baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+
+        print('No regressions against baseline')
@@ -0,0 +1,158 @@
+import argparse
+import math
+import os
+import sys
+
+import yaml
+from PIL import Image
+
+from map2gazebo import DEFAULT_OPTIONS, MESHERS, process_maps
+
+
+MANIFEST_EXAMPLE = """
+manifest example (YAML or JSON):
+  height: 1.0
+  maps:
+    - image: floor1.png              # relative to the manifest
+      map_name: floor1               # optional, defaults to the image name
+      points: [[120, 340], [980, 340]]
+      distance: 12.5                 # meters between the two points
+      origin_pixel: [120, 900]
+    - image: floor2.png
+      resolution: 0.05               # instead of points and distance
+      origin: [-3.0, -4.5, 0.0]      # instead of origin_pixel
+"""
+
+def meters_per_pixel(point_a, point_b, distance):
+    # Scale from two image pixels a known distance in meters apart
+    pixel_distance = math.dist(point_a, point_b)
+    if pixel_distance <= 0 or distance <= 0:
+        raise ValueError(f'Cannot calibrate from points {point_a}, {point_b} and distance {distance}')
+
+    return distance / pixel_distance
+
+def origin_from_pixel(pixel, image_height, resolution):
+    # World origin of the map that puts the world (0, 0) at the image pixel, map_server convention:
+    # the origin is the bottom-left corner and the image y-axis points down
+    x, y = pixel
+    world_x = - ((x + 0.5) * resolution)
+    world_y = - (((image_height - y) + 0.5) * resolution)
+    return [world_x, world_y, 0.0]
+
+def build_map_info(image_path, resolution=None, origin=None, map_name=None, negate=0, occupied_thresh=0.65,
+                   free_thresh=0.196):
+    # The map_info dictionary process_maps expects, named after the image by default
+    return {
+        "map_name": map_name or os.path.splitext(os.path.basename(image_path))[0],
+        "image": image_path,
+        "resolution": resolution,
+        "origin": list(origin) if origin is not None else [0.0, 0.0, 0.0],
+        "negate": negate,
+        "occupied_thresh": occupied_thresh,
+        "free_thresh": free_thresh,
+    }
+
+def calibrate(entry, base_dir='.'):
+    # map_info of one manifest entry, from points and distance or an explicit resolution and origin
+    image_path = entry['image']
+    if not os.path.isabs(image_path):
+        image_path = os.path.join(base_dir, image_path)
+
+    if 'resolution' in entry:
+        resolution = float(entry['resolution'])
+    else:
+        point_a, point_b = entry['points']
+        resolution = meters_per_pixel(point_a, point_b, float(entry['distance']))
+
+    if 'origin' in entry:
+        origin = entry['origin']
+    elif 'origin_pixel' in entry:
+        # Only the header is read for the height, the pixels are left to map2gazebo
+        with Image.open(image_path) as image:
+            origin = origin_from_pixel(entry['origin_pixel'], image.height, resolution)
+    else:
+        origin = None
+
+    return build_map_info(
+        image_path, resolution, origin, entry.get('map_name'), entry.get('negate', 0),
+        entry.get('occupied_thresh', 0.65), entry.get('free_thresh', 0.196)
+    )
+
+def load_manifest(manifest_path):
+    # YAML is a superset of JSON, so either format parses here
+    with open(manifest_path, 'r') as stream:
+        manifest = yaml.safe_load(stream)
+
+    if isinstance(manifest, list):
+        manifest = {'maps': manifest}
+    return manifest
+
+def calibrate_manifest(manifest, base_dir='.'):
+    map_info_list = []
+    for index, entry in enumerate(manifest.get('maps') or []):
+        try:
+            map_info_list.append(calibrate(entry, base_dir))
+        except Exception as e:
+            print(f"Error calibrating manifest entry {index} ({entry.get('image')}): {str(e)}")
+
+    return map_info_list
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Calibrate floor plan images from a manifest and convert them with map2gazebo',
+        epilog=MANIFEST_EXAMPLE, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument(
+        '--manifest', type=str, required=True,
+        help='YAML or JSON file listing the images and their calibration points'
+    )
+
+    parser.add_argument(
+        '--model_dir', type=str, default=os.path.abspath('.'),
+        help='Directory to save the generated models'
+    )
+
+    parser.add_argument(
+        '--world_dir', type=str, default=os.path.abspath('.'),
+        help='Directory to save the generated world files'
+    )
+
+    parser.add_argument(
+        '--height', type=float, default=None,
+        help='Wall height in meters, overrides the manifest height (default 1.0)'
+    )
+
+    parser.add_argument(
+        '--mesher', type=str, choices=MESHERS, default=DEFAULT_OPTIONS['mesher'],
+        help='Mesh generation algorithm, see map2gazebo'
+    )
+
+    parser.add_argument(
+        '--jobs', type=int, default=0,
+        help='Number of images converted in parallel worker processes (0 uses every core)'
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.manifest):
+        print(f"Error: Manifest {args.manifest} not found")
+        sys.exit(1)
+
+    manifest = load_manifest(args.manifest)
+    map_info_list = calibrate_manifest(manifest, os.path.dirname(os.path.abspath(args.manifest)))
+
+    if not map_info_list:
+        print("No valid map entries found. Exiting.")
+        sys.exit(1)
+
+    for map_info in map_info_list:
+        print(f"Calibrated {map_info['map_name']}: resolution {map_info['resolution']:.6f} m/pixel, "
+              f"origin {map_info['origin']}")
+
+    height = args.height if args.height is not None else manifest.get('height', 1.0)
+    success_count, fail_count = process_maps(
+        map_info_list, args.model_dir, args.world_dir, height, jobs=args.jobs, mesher=args.mesher
+    )
+    # Entries that could not be calibrated count as failures too
+    sys.exit(1 if fail_count or len(map_info_list) < len(manifest.get('maps') or []) else 0)
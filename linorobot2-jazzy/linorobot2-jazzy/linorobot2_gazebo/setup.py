@@ -14,12 +14,14 @@ setup(
         (os.path.join('share', package_name, 'launch'), glob(os.path.join('launch', '*.launch.py'))),
         (os.path.join('share', package_name, 'worlds'), glob(os.path.join('worlds', '*.sdf'))),
         (os.path.join('share', package_name, 'rviz'), glob(os.path.join('rviz', '*.rviz'))),
+        (os.path.join('share', package_name, 'config'), glob(os.path.join('config', '*.yaml'))),
         (os.path.join('share', package_name, 'hook'), glob('hook/*.sh')),
         *[(os.path.join('share', package_name, os.path.dirname(file_path)), [file_path]) 
           for file_path in glob(os.path.join('models', '**/*'), recursive=True) 
           if os.path.isfile(file_path)],        
     ],
     zip_safe=True,
+    tests_require=['pytest'],
     author='Juan Miguel Jimeno',
     author_email='jimenojmm@gmail.com',
     maintainer='Juan Miguel Jimeno',
@@ -28,7 +30,8 @@ setup(
     license='Apache 2.0',
     entry_points={
         'console_scripts': [
-            'command_timeout = linorobot2_gazebo.command_timeout:main'
+            'command_timeout = linorobot2_gazebo.command_timeout:main',
+            'cmd_vel_mux = linorobot2_gazebo.cmd_vel_mux:main'
         ],
     },
 )
\ No newline at end of file
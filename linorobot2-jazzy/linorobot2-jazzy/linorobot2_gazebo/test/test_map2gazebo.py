@@ -0,0 +1,74 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+import yaml
+
+from linorobot2_gazebo.map2gazebo import load_map_image, occupied_cells, wall_map
+
+
+MAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'linorobot2_navigation', 'maps')
+
+SHIPPED_MAPS = ('turtlebot3_world', 'playground', 'map')
+
+ROOM_INFO = {
+    'resolution': 0.05,
+    'origin': [0.0, 0.0, 0.0],
+    'negate': 0,
+    'occupied_thresh': 0.65,
+    'free_thresh': 0.196,
+}
+
+def enclosed_room_map(size=12, room=4):
+    # A free room in the middle of unknown space, whose only walls come from the unknown pixels around it
+    image = np.full((size, size), 205, dtype=np.uint8)
+    start = (size - room) // 2
+    image[start:start + room, start:start + room] = 254
+    return image
+
+def load_shipped_map(map_name):
+    yaml_file = os.path.join(MAP_DIR, f'{map_name}.yaml')
+    if not os.path.exists(yaml_file):
+        pytest.skip(f'shipped map {map_name} not found in {MAP_DIR}')
+
+    with open(yaml_file, 'r') as stream:
+        map_info = yaml.safe_load(stream)
+    return load_map_image(os.path.join(MAP_DIR, map_info['image'])), map_info
+
+def crop_offset(metadata, cropped_metadata):
+    x0 = round((cropped_metadata['origin'][0] - metadata['origin'][0]) / metadata['resolution'])
+    y0 = round((cropped_metadata['origin'][1] - metadata['origin'][1]) / metadata['resolution'])
+    return y0, x0
+
+def assert_crop_keeps_walls(map_array, metadata):
+    full, full_metadata = wall_map(map_array, metadata, crop=False)
+    cropped, cropped_metadata = wall_map(map_array, metadata)
+    full_cells = occupied_cells(full, full_metadata)
+    cells = occupied_cells(cropped, cropped_metadata)
+
+    # The cropped cells are the same window of the uncropped ones
+    y0, x0 = crop_offset(metadata, cropped_metadata)
+    window = (slice(y0, y0 + cells.shape[0]), slice(x0, x0 + cells.shape[1]))
+    np.testing.assert_array_equal(full_cells[window], cells)
+
+    # And every wall next to free space lies inside that window
+    near_free = cv2.dilate((~full_cells).astype(np.uint8), np.ones((3, 3), np.uint8)).astype(bool)
+    enclosing = full_cells & near_free
+    enclosing[window] = False
+    assert not enclosing.any()
+
+def test_crop_keeps_room_enclosed():
+    cropped, metadata = wall_map(enclosed_room_map(), ROOM_INFO)
+    cells = occupied_cells(cropped, metadata)
+
+    # A ring of unknown walls around the 4x4 room, on all four sides
+    assert cells.shape == (6, 6)
+    assert cells[0].all() and cells[-1].all() and cells[:, 0].all() and cells[:, -1].all()
+    assert not cells[1:-1, 1:-1].any()
+    assert_crop_keeps_walls(enclosed_room_map(), ROOM_INFO)
+
+@pytest.mark.parametrize('map_name', SHIPPED_MAPS)
+def test_crop_matches_uncropped_map(map_name):
+    map_array, map_info = load_shipped_map(map_name)
+    assert_crop_keeps_walls(map_array, map_info)